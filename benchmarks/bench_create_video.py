@@ -0,0 +1,204 @@
+"""Offline benchmark for create_video() on synthetic inputs (no network needed).
+
+Each duration x effect-count case is rendered in a fresh process, first with empty
+caches and then warm; results are saved as JSON so commits can be compared:
+
+    python benchmarks/bench_create_video.py --durations 5,30 --effects 0,1,3
+    python benchmarks/bench_create_video.py --compare benchmarks/results/bench_<commit>.json
+"""
+from pathlib import Path
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import contextlib
+
+import numpy as np
+from PIL import Image
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+from ffmpeg_tools import run_ffmpeg
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+def make_image(path, width, height, seed=0):
+    """Noisy gradient PNG, so PNG decode and resampling do realistic work"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    image = np.stack([x * 255 // max(width - 1, 1), y * 255 // max(height - 1, 1),
+                      (x + y) * 255 // max(width + height - 2, 1)], axis=-1).astype(np.int16)
+    image += rng.integers(-24, 24, size=image.shape, dtype=np.int16)
+    Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)).save(path)
+    return path
+
+def make_audio(path, seconds, kind="sine"):
+    """MP3 narration stand-in: a 440 Hz sine or pink noise"""
+    source = f"sine=frequency=440:duration={seconds}" if kind == "sine" else \
+        f"anoisesrc=color=pink:amplitude=0.3:duration={seconds}"
+    run_ffmpeg(["-f", "lavfi", "-i", source, "-ac", "1", "-ar", "44100", "-c:a", "libmp3lame", "-b:a", "128k", path])
+    return path
+
+def make_overlay(path, index, seconds=4, width=1280, height=720, fps=30):
+    """Synthetic overlay clip; every index uses a different generator"""
+    sources = ["testsrc2", "mandelbrot", "cellauto", "life", "rgbtestsrc"]
+    spec = f"{sources[index % len(sources)]}=size={width}x{height}:rate={fps}"
+    run_ffmpeg(["-f", "lavfi", "-i", spec, "-t", seconds, "-pix_fmt", "yuv420p", "-c:v", "libx264",
+                "-preset", "ultrafast", path])
+    return path
+
+def render_case(image_path, audio_path, effect_paths, output_path, options):
+    """Worker entry point: one render in a fresh process, returns the render profile"""
+    from create_video import create_video
+    start = time.perf_counter()
+    result = create_video(image_path, audio_path, output_path, [Path(p) for p in effect_paths],
+                          encoder=options["encoder"], segments=options["segments"], profile=True,
+                          cache_segments=False)
+    wall = time.perf_counter() - start
+    if result is None:
+        raise RuntimeError("create_video failed")
+    profile_path = Path(output_path).with_name(Path(output_path).stem + ".profile.json")
+    with open(profile_path, "r", encoding="utf-8") as f:
+        profile = json.load(f)
+    profile["wall_seconds"] = round(wall, 3)
+    return profile
+
+@contextlib.contextmanager
+def cache_env(cache_dir):
+    """Point every cache of the render process into cache_dir (restoring os.environ afterwards),
+    so cold runs start empty and the benchmark never touches the repo's cache/"""
+    saved = dict(os.environ)
+    os.environ.update({
+        "OVERLAY_CACHE_DIR": str(cache_dir / "overlays"),
+        "IMAGE_CACHE_DIR": str(cache_dir / "images"),
+        # Unused (render_case passes cache_segments=False), but never the shared one
+        "SEGMENT_CACHE_DIR": str(cache_dir / "segments"),
+    })
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+def run_case(duration, n_effects, inputs, work_dir, options):
+    """Render one case `repeat` times: the first run with empty caches, the rest warm"""
+    cache_dir = work_dir / f"cache_{duration}s_{n_effects}fx"
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    runs = []
+    for run in range(options["repeat"]):
+        output_path = work_dir / f"out_{duration}s_{n_effects}fx_{run}.mp4"
+        # A fresh spawned process per run, so peak memory and import costs belong to this run only
+        with cache_env(cache_dir), \
+                ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            profile = pool.submit(render_case, str(inputs["image"]), str(inputs["audio"][duration]),
+                                  [str(p) for p in inputs["overlays"][:n_effects]], str(output_path),
+                                  options).result()
+        frames = profile["frames"]
+        runs.append({
+            "cache": "cold" if run == 0 else "warm",
+            "wall_seconds": profile["wall_seconds"],
+            "frames": frames,
+            "video_frames": int(np.ceil(duration * 24)),
+            "video_seconds_per_wall_second": round(duration / profile["wall_seconds"], 3),
+            "frames_per_second": profile["frames_per_second"],
+            "frame_generation_seconds": profile["frame_generation_seconds"],
+            "encoder_seconds": profile["encoder_seconds"],
+            "peak_rss_mb": profile["peak_rss_mb"],
+            "stages": profile["stages"],
+        })
+        print(f"  {duration}s, {n_effects} effects, {runs[-1]['cache']} cache: "
+              f"{profile['wall_seconds']:.2f}s wall, {profile['frames_per_second']} fps")
+    return {"duration": duration, "effects": n_effects, "runs": runs}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def compare(results, baseline_path):
+    """Print the warm wall time of each case against a previous results file"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(c["duration"], c["effects"]): c for c in baseline["cases"]}
+    print(f"\nComparison with {baseline_path} (commit {baseline.get('commit')}), last run of each case:")
+    for case in results["cases"]:
+        old = previous.get((case["duration"], case["effects"]))
+        new_wall = case["runs"][-1]["wall_seconds"]
+        if old is None:
+            print(f"  {case['duration']}s, {case['effects']} effects: {new_wall:.2f}s (no baseline)")
+            continue
+        old_wall = old["runs"][-1]["wall_seconds"]
+        change = (new_wall - old_wall) / old_wall * 100 if old_wall else 0.0
+        print(f"  {case['duration']}s, {case['effects']} effects: {old_wall:.2f}s -> {new_wall:.2f}s ({change:+.1f}%)")
+
+def parse_list(text, cast):
+    return [cast(value) for value in text.split(",") if value.strip()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark create_video() on synthetic inputs")
+    parser.add_argument("--durations", default="5,15,30", help="Comma separated video lengths in seconds")
+    parser.add_argument("--effects", default="0,1,3", help="Comma separated overlay counts")
+    parser.add_argument("--image-size", default="1024x1536", help="Source image size WxH")
+    parser.add_argument("--audio", choices=["sine", "noise"], default="sine")
+    parser.add_argument("--repeat", type=int, default=2, help="Runs per case (the first one has a cold cache)")
+    parser.add_argument("--encoder", default="default", help="Encoder preset passed to create_video")
+    parser.add_argument("--segments", default=1, type=lambda v: v if v == "auto" else int(v))
+    parser.add_argument("--output", default=None, help="Results JSON (default: benchmarks/results/bench_<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Previous results JSON to compare against")
+    args = parser.parse_args()
+
+    try:
+        durations = parse_list(args.durations, float)
+        durations = [int(d) if d.is_integer() else d for d in durations]
+        effect_counts = parse_list(args.effects, int)
+        width, height = (int(v) for v in args.image_size.lower().split("x"))
+        options = {"encoder": args.encoder, "segments": args.segments, "repeat": max(1, args.repeat)}
+
+        work_dir = Path(tempfile.mkdtemp(prefix="bench_create_video_"))
+        try:
+            print("Generating synthetic inputs...")
+            inputs = {
+                "image": make_image(work_dir / "image.png", width, height),
+                "audio": {d: make_audio(work_dir / f"speech_{d}s.mp3", d, args.audio) for d in durations},
+                "overlays": [make_overlay(work_dir / f"{i:02d}_overlay.mp4", i) for i in range(max(effect_counts))],
+            }
+
+            cases = []
+            for duration in durations:
+                for n_effects in effect_counts:
+                    print(f"Case: {duration}s video, {n_effects} effects")
+                    cases.append(run_case(duration, n_effects, inputs, work_dir, options))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        results = {
+            "commit": git_commit(),
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                        "cpu_count": os.cpu_count()},
+            "settings": {"image_size": [width, height], "audio": args.audio, **options},
+            "cases": cases,
+        }
+        output_path = Path(args.output) if args.output else RESULTS_DIR / f"bench_{results['commit']}.json"
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBenchmark results saved to: {output_path}")
+
+        if args.compare:
+            compare(results, args.compare)
+    except Exception as e:
+        print(f"\nBenchmark failed: {e}")
+        traceback.print_exc()
+        sys.exit(1)
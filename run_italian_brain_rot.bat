@@ -58,7 +58,7 @@ echo 🎉 ALL STEPS COMPLETED SUCCESSFULLY! 🎉
 echo ===================================================
 echo.
 echo Your Italian Brain Rot video has been created.
-echo Check the 'results/videos' directory for the final video.
+echo Check the 'results/runs' directory for the final video.
 echo.
 
 echo Do you want to upload the video to YouTube? (Y/N)
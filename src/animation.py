@@ -0,0 +1,283 @@
+import numpy as np
+from PIL import Image
+
+def _out_bounce(p):
+    n, d = 7.5625, 2.75
+    return np.select([p < 1 / d, p < 2 / d, p < 2.5 / d],
+                     [n * p * p, n * (p - 1.5 / d) ** 2 + 0.75, n * (p - 2.25 / d) ** 2 + 0.9375],
+                     n * (p - 2.625 / d) ** 2 + 0.984375)
+
+def _out_back(p, overshoot=1.70158):
+    return 1 + (overshoot + 1) * (p - 1) ** 3 + overshoot * (p - 1) ** 2
+
+# Easing curves map the progress of a keyframe segment (0..1, numpy arrays) to the eased progress
+EASINGS = {
+    "linear": lambda p: p,
+    "ease_in": lambda p: p * p,
+    "ease_out": lambda p: 1 - (1 - p) ** 2,
+    "ease_in_out": lambda p: p * p * (3 - 2 * p),
+    "out_back": _out_back,
+    "out_bounce": _out_bounce,
+}
+
+class Keyframes:
+    """A value keyframed over time.
+
+    points: (seconds, value) or (seconds, value, easing) tuples. The easing of a point applies to
+    the segment leading to the next point (default: `easing`). The value is held before the first
+    and after the last point.
+    """
+
+    def __init__(self, points, easing="linear"):
+        points = sorted(points, key=lambda point: point[0])
+        if not points:
+            raise ValueError("Keyframes need at least one point")
+        self.times = np.array([point[0] for point in points], dtype=np.float64)
+        self.values = np.array([point[1] for point in points], dtype=np.float64)
+        self.easings = [point[2] if len(point) > 2 else easing for point in points]
+        for name in self.easings:
+            if name not in EASINGS:
+                raise ValueError(f"Unknown easing '{name}'. Available: {', '.join(EASINGS)}")
+
+    @property
+    def end(self):
+        return self.times[-1]
+
+    def sample(self, times):
+        """Values at an array of times (seconds)"""
+        times = np.asarray(times, dtype=np.float64)
+        if len(self.times) == 1:
+            return np.full(times.shape, self.values[0])
+        segment = np.clip(np.searchsorted(self.times, times, side="right") - 1, 0, len(self.times) - 2)
+        start, end = self.times[segment], self.times[segment + 1]
+        span = np.where(end > start, end - start, 1.0)
+        progress = np.clip((times - start) / span, 0.0, 1.0)
+        eased = np.empty_like(progress)
+        for index, name in enumerate(self.easings[:-1]):
+            in_segment = segment == index
+            if in_segment.any():
+                eased[in_segment] = EASINGS[name](progress[in_segment])
+        return self.values[segment] + (self.values[segment + 1] - self.values[segment]) * eased
+
+class Shake:
+    """Camera shake: smooth pseudo-random jitter of the position (fraction of the canvas) and
+    rotation (degrees), fading out linearly from `start` to `end` seconds. Seeded, so every
+    process rendering part of a video computes the same shake."""
+
+    def __init__(self, amplitude=0.01, rotation=1.0, frequency=8.0, start=0.0, end=1.0, seed=0):
+        self.amplitude = amplitude
+        self.rotation = rotation
+        self.frequency = frequency
+        self.start = start
+        self.end = end
+        self.seed = seed
+
+    def offsets(self, times):
+        """(x, y, angle) offsets at an array of times"""
+        times = np.asarray(times, dtype=np.float64)
+        length = max(self.end - self.start, 1e-9)
+        envelope = np.clip(1.0 - (times - self.start) / length, 0.0, 1.0)
+        envelope[times < self.start] = 0.0
+        waves = _jitter(times, self.frequency, self.seed)
+        return (self.amplitude * envelope * waves[0], self.amplitude * envelope * waves[1],
+                self.rotation * envelope * waves[2])
+
+def _jitter(times, frequency, seed):
+    """Three smooth pseudo-random waves in [-1, 1] (x, y, angle) sampled at `times`"""
+    # Each channel is a sum of three sines with incommensurate frequencies and random phases
+    rng = np.random.default_rng(seed)
+    phases = rng.uniform(0, 2 * np.pi, size=(3, 3))
+    ratios = np.array([1.0, 1.73, 2.91])
+    return np.sin(2 * np.pi * frequency * ratios[None, :, None] * times + phases[..., None]).mean(axis=1)
+
+class AudioReactive:
+    """Drives the image with the narration: `level` holds one value in [0, 1] per video frame
+    (an envelope from audio_loader.NarrationAudio.envelope). At full level the image is scaled up
+    by `scale`, brightened by `brightness` and shaken by `shake` (fraction of the canvas)."""
+
+    def __init__(self, level, fps, scale=0.06, brightness=0.0, shake=0.0, frequency=6.0, seed=0):
+        self.level = np.asarray(level, dtype=np.float64)
+        self.fps = fps
+        self.scale = scale
+        self.brightness = brightness
+        self.shake = shake
+        self.frequency = frequency
+        self.seed = seed
+
+    @property
+    def end(self):
+        return len(self.level) / self.fps
+
+    def sample(self, times):
+        """Level at an array of times (the frame each time falls in, 0 after the narration)"""
+        index = np.floor(np.asarray(times, dtype=np.float64) * self.fps + 1e-6).astype(np.int64)
+        inside = (index >= 0) & (index < len(self.level))
+        return np.where(inside, self.level[np.clip(index, 0, max(len(self.level) - 1, 0))], 0.0)
+
+    def offsets(self, times):
+        """(x, y) shake offsets (fractions of the canvas) at an array of times"""
+        level = self.sample(times)
+        if not self.shake:
+            return np.zeros_like(level), np.zeros_like(level)
+        waves = _jitter(np.asarray(times, dtype=np.float64), self.frequency, self.seed)
+        return self.shake * level * waves[0], self.shake * level * waves[1]
+
+class Animation:
+    """Keyframed transform of the image: scale, counterclockwise rotation (degrees) and translation
+    of its center (fractions of the canvas width/height), each a constant or Keyframes, plus an
+    optional Shake and AudioReactive. compile() turns it into per-frame tables in one vectorized pass."""
+
+    def __init__(self, scale=1.0, rotation=0.0, x=0.0, y=0.0, shake=None, reactive=None):
+        self.scale = scale
+        self.rotation = rotation
+        self.x = x
+        self.y = y
+        self.shake = shake
+        self.reactive = reactive
+
+    @property
+    def end(self):
+        """Time (seconds) after which the transform no longer changes"""
+        ends = [track.end for track in (self.scale, self.rotation, self.x, self.y) if isinstance(track, Keyframes)]
+        if self.shake is not None:
+            ends.append(self.shake.end)
+        if self.reactive is not None:
+            ends.append(self.reactive.end)
+        return max(ends, default=0.0)
+
+    def compile(self, n_frames, fps):
+        """(scale, rotation, x, y) arrays with one value per frame"""
+        times = np.arange(n_frames) / fps
+        scale, rotation, x, y = (track.sample(times) if isinstance(track, Keyframes)
+                                 else np.full(n_frames, float(track))
+                                 for track in (self.scale, self.rotation, self.x, self.y))
+        if self.shake is not None:
+            dx, dy, angle = self.shake.offsets(times)
+            x, y, rotation = x + dx, y + dy, rotation + angle
+        if self.reactive is not None:
+            level = self.reactive.sample(times)
+            scale = scale * (1.0 + self.reactive.scale * level)
+            dx, dy = self.reactive.offsets(times)
+            x, y = x + dx, y + dy
+        return scale, rotation, x, y
+
+    def brightness(self, n_frames, fps):
+        """Brightness gain per frame, or None if the animation does not change the brightness"""
+        if self.reactive is None or not self.reactive.brightness:
+            return None
+        return 1.0 + self.reactive.brightness * self.reactive.sample(np.arange(n_frames) / fps)
+
+def get_animation_duration(total_duration, animation_duration=2.0):
+    """Length of an intro animation, capped at a third of the video"""
+    # If animation_duration is too long compared to total_duration, reduce it
+    if animation_duration > total_duration / 3:
+        animation_duration = total_duration / 3
+    return animation_duration
+
+def grow_and_turn(total_duration, start_scale=0.5, turns=1.0):
+    """Similar to PowerPoint's Grow & Turn: the image starts at half size and makes a full turn while growing"""
+    duration = get_animation_duration(total_duration)
+    return Animation(scale=Keyframes([(0, start_scale), (duration, 1.0)]),
+                     rotation=Keyframes([(0, 0.0), (duration, 360.0 * turns)]))
+
+def ken_burns(total_duration, zoom=1.15, pan=(-0.04, -0.03)):
+    """Slow zoom and pan over the whole video"""
+    return Animation(scale=Keyframes([(0, 1.0), (total_duration, zoom)], easing="ease_in_out"),
+                     x=Keyframes([(0, 0.0), (total_duration, pan[0])], easing="ease_in_out"),
+                     y=Keyframes([(0, 0.0), (total_duration, pan[1])], easing="ease_in_out"))
+
+def bounce(total_duration, start_scale=0.3):
+    """The image drops in from above and bounces into place"""
+    duration = get_animation_duration(total_duration, 1.5)
+    return Animation(scale=Keyframes([(0, start_scale), (duration, 1.0)], easing="out_back"),
+                     y=Keyframes([(0, -0.5), (duration, 0.0)], easing="out_bounce"))
+
+def shake(total_duration, amplitude=0.015):
+    """A short camera shake that settles"""
+    duration = get_animation_duration(total_duration, 1.5)
+    return Animation(scale=1.0, shake=Shake(amplitude=amplitude, rotation=2.0, end=duration))
+
+# Built-in animations by name, each a function of the video length returning an Animation
+ANIMATION_PRESETS = {
+    "grow_and_turn": grow_and_turn,
+    "ken_burns": ken_burns,
+    "bounce": bounce,
+    "shake": shake,
+}
+
+def get_animation(animation, total_duration):
+    """Accept an Animation, a preset name from ANIMATION_PRESETS or None (no animation)"""
+    if animation is None or isinstance(animation, Animation):
+        return animation
+    if animation not in ANIMATION_PRESETS:
+        raise ValueError(f"Unknown animation '{animation}'. Available: {', '.join(ANIMATION_PRESETS)}")
+    return ANIMATION_PRESETS[animation](total_duration)
+
+def affine_coefficients(scale, angle, image_size, center):
+    """PIL AFFINE data (output -> source map) for drawing an image scaled by `scale` and rotated
+    counterclockwise by `angle` degrees around its own center, with that center placed at `center`.
+
+    scale and angle may be arrays; the result then has one row of 6 coefficients per value.
+    """
+    scale = np.asarray(scale, dtype=np.float64)
+    theta = np.radians(angle)
+    cos = np.cos(theta) / scale
+    sin = np.sin(theta) / scale
+    image_cx, image_cy = image_size[0] / 2, image_size[1] / 2
+    cx, cy = center
+    # source = R(-angle) * (output - center) / scale + image center
+    return np.stack([cos, -sin, image_cx - cos * cx + sin * cy,
+                     sin, cos, image_cy - sin * cx - cos * cy], axis=-1)
+
+class AffineAnimation:
+    """A still image animated by one affine matrix per frame.
+
+    The matrices of every animated frame are computed up front, together with the canvas box the
+    transformed image covers. Each frame is then a single resample of the source straight into
+    canvas coordinates (only inside that box), so no intermediate resized or rotated copies are made.
+
+    The box changes size from frame to frame. PIL has no public way to transform into an existing
+    image, and the bicubic resample is what costs the time (a reused canvas-sized buffer measured
+    the same), while the box keeps the small early frames cheap.
+    """
+
+    def __init__(self, image, canvas_size, matrices):
+        # Premultiplied, so the bicubic filter does not bleed the transparent surroundings into the edges
+        self.image = image.convert("RGBA").convert("RGBa")
+        self.canvas_size = canvas_size
+        self.matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 6)
+        self.boxes = self._canvas_boxes()
+
+    def __len__(self):
+        return len(self.matrices)
+
+    def _canvas_boxes(self):
+        """(x0, y0, x1, y1) canvas box covered by the image in every frame, clipped to the canvas"""
+        a, b, c, d, e, f = self.matrices.T
+        # Invert the output -> source map to find where the image corners land on the canvas
+        det = a * e - b * d
+        w, h = self.image.size
+        corners = np.array([[0, 0], [w, 0], [0, h], [w, h]], dtype=np.float64)
+        sx = corners[:, 0][None, :] - c[:, None]
+        sy = corners[:, 1][None, :] - f[:, None]
+        xs = (e[:, None] * sx - b[:, None] * sy) / det[:, None]
+        ys = (a[:, None] * sy - d[:, None] * sx) / det[:, None]
+        # Two pixels of margin for the bicubic filter's footprint
+        width, height = self.canvas_size
+        x0 = np.clip(np.floor(xs.min(axis=1)) - 2, 0, width).astype(int)
+        y0 = np.clip(np.floor(ys.min(axis=1)) - 2, 0, height).astype(int)
+        x1 = np.clip(np.ceil(xs.max(axis=1)) + 2, 0, width).astype(int)
+        y1 = np.clip(np.ceil(ys.max(axis=1)) + 2, 0, height).astype(int)
+        return np.stack([x0, y0, x1, y1], axis=-1)
+
+    def frame(self, index):
+        """Premultiplied RGBA pixels of the box the image covers (a new array of that box's size)
+        and the box's top-left corner, or (None, 0, 0) if the image is entirely off the canvas"""
+        x0, y0, x1, y1 = (int(v) for v in self.boxes[index])
+        if x1 <= x0 or y1 <= y0:
+            return None, 0, 0
+        a, b, c, d, e, f = self.matrices[index]
+        # Same matrix, with the output origin moved to the box corner
+        data = (a, b, c + a * x0 + b * y0, d, e, f + d * x0 + e * y0)
+        layer = self.image.transform((x1 - x0, y1 - y0), Image.AFFINE, data, resample=Image.BICUBIC)
+        return np.asarray(layer), x0, y0
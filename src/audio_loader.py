@@ -0,0 +1,73 @@
+from pathlib import Path
+import re
+import subprocess
+import numpy as np
+from ffmpeg_tools import FFMPEG_BINARY, probe_media
+
+_AUDIO_STREAM_RE = re.compile(r"Stream #\d+:\d+.*?: Audio: (\w+)(?:.*?, (\d+) Hz)?")
+
+def probe_audio(path):
+    """Read duration, codec and sample rate from the container header without decoding"""
+    info, duration = probe_media(path)
+    if duration is None:
+        raise RuntimeError(f"Could not read the duration of {path}:\n{info}")
+
+    stream_match = _AUDIO_STREAM_RE.search(info)
+    if not stream_match:
+        raise RuntimeError(f"No audio stream found in {path}")
+    codec, sample_rate = stream_match.groups()
+    return {"duration": duration, "codec": codec, "sample_rate": int(sample_rate) if sample_rate else None}
+
+class NarrationAudio:
+    """The narration of one render: header metadata up front, PCM decoded at most once on demand"""
+
+    def __init__(self, path, sample_rate=44100):
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        info = probe_audio(self.path)
+        self.duration = info["duration"]
+        self.codec = info["codec"]
+        self.source_sample_rate = info["sample_rate"]
+        self._samples = None
+
+    def samples(self):
+        """Mono float32 PCM in [-1, 1] at self.sample_rate, decoded on the first call and shared afterwards"""
+        if self._samples is None:
+            print(f"Decoding audio {self.path.name} to PCM...")
+            result = subprocess.run([FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-i", str(self.path),
+                                     "-f", "f32le", "-ac", "1", "-ar", str(self.sample_rate), "-"],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if result.returncode != 0:
+                raise RuntimeError(f"Could not decode {self.path}: {result.stderr.decode(errors='replace')}")
+            self._samples = np.frombuffer(result.stdout, dtype=np.float32)
+        return self._samples
+
+    def envelope(self, fps, n_frames, smoothing=0.1):
+        """Loudness (RMS) and onset strength of the narration, one value in [0, 1] per video frame"""
+        return amplitude_envelope(self.samples(), self.sample_rate, fps, n_frames, smoothing)
+
+def amplitude_envelope(samples, sample_rate, fps, n_frames, smoothing=0.1):
+    """(rms, onset) arrays with one value per video frame, both normalized to [0, 1].
+
+    rms is the loudness of the samples each frame covers, smoothed over `smoothing` seconds;
+    onset is its rise from the previous frame, which peaks at the start of syllables and words.
+    Computed for the whole narration at once from cumulative sums, no per-frame audio access.
+    """
+    bounds = np.minimum(np.round(np.arange(n_frames + 1) * sample_rate / fps).astype(np.int64), len(samples))
+    energy = np.concatenate(([0.0], np.cumsum(np.square(samples, dtype=np.float64))))
+    counts = np.maximum(np.diff(bounds), 1)
+    rms = np.sqrt((energy[bounds[1:]] - energy[bounds[:-1]]) / counts)
+
+    width = int(round(smoothing * fps))
+    if width > 1:
+        window = np.hanning(width + 2)[1:-1]
+        rms = np.convolve(rms, window / window.sum(), mode="same")
+    onset = np.maximum(np.diff(rms, prepend=rms[:1]), 0.0)
+    return _normalize(rms), _normalize(onset)
+
+def _normalize(values, percentile=95):
+    """Scale to [0, 1] with the given percentile at 1, so a few peaks don't flatten the rest"""
+    reference = np.percentile(values, percentile) if len(values) else 0.0
+    if reference <= 0:
+        reference = values.max() if len(values) and values.max() > 0 else 1.0
+    return np.clip(values / reference, 0.0, 1.0).astype(np.float32)
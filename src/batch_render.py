@@ -0,0 +1,193 @@
+from pathlib import Path
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from create_video import create_video, get_effect_paths
+from ffmpeg_tools import ENCODER_PRESETS, get_encoder_settings
+from runs import RUNS_DIR, list_runs
+
+# Videos of jobs files without an output, and the batch reports, go here (runs write into their own directory)
+BATCH_DIR = RUNS_DIR / "batch"
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.webp']
+AUDIO_EXTENSIONS = ['.mp3', '.wav', '.m4a', '.aac', '.ogg']
+
+def load_jobs_file(jobs_file):
+    """Read jobs from a JSON list of {"image": ..., "speech": ..., "output": ...} objects"""
+    with open(jobs_file, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    base_dir = Path(jobs_file).parent
+    jobs = []
+    for idx, entry in enumerate(entries):
+        image = base_dir / entry["image"]
+        speech = base_dir / entry["speech"]
+        output = base_dir / entry["output"] if entry.get("output") else \
+            BATCH_DIR / f"{image.stem}_{speech.stem}.mp4"
+        jobs.append({"name": entry.get("name", f"job_{idx + 1}"), "image": image, "speech": speech, "output": output})
+    return jobs
+
+def find_jobs_in_directory(jobs_dir):
+    """Every subdirectory holding one image and one audio file is a job; the video is written next to them"""
+    jobs = []
+    for job_dir in sorted(p for p in Path(jobs_dir).iterdir() if p.is_dir()):
+        images = sorted(p for p in job_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+        speeches = sorted(p for p in job_dir.iterdir() if p.suffix.lower() in AUDIO_EXTENSIONS)
+        if not images or not speeches:
+            print(f"Skipping {job_dir}: it needs an image and a speech file")
+            continue
+        jobs.append({"name": job_dir.name, "image": images[0], "speech": speeches[0],
+                     "output": job_dir / "video.mp4"})
+    return jobs
+
+def find_pending_results():
+    """Runs in results/runs that have an image and a speech but no video yet"""
+    jobs = []
+    for run in list_runs():
+        if run.image_path.exists() and run.speech_path.exists() and not run.video_path.exists():
+            jobs.append({"name": f"run_{run.run_id}", "image": run.image_path, "speech": run.speech_path,
+                         "output": run.video_path})
+    return jobs
+
+def render_job(job, effect_paths, encoder_settings, log_dir):
+    """Worker entry point: render one job, with its console output captured in a log file (next to
+    the video, or in log_dir)"""
+    start = time.time()
+    result = {"name": job["name"], "image": str(job["image"]), "speech": str(job["speech"]),
+              "output": str(job["output"]), "status": "failed", "error": None}
+    log_path = Path(log_dir) / f"{job['name']}.log" if log_dir else Path(job["output"]).with_suffix(".log")
+    result["log"] = str(log_path)
+    try:
+        Path(job["output"]).parent.mkdir(parents=True, exist_ok=True)
+        with open(log_path, "w", encoding="utf-8") as log, \
+                contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            video_path = create_video(job["image"], job["speech"], job["output"], effect_paths,
+                                      encoder=encoder_settings)
+        if video_path:
+            result["status"] = "ok"
+        else:
+            result["error"] = f"create_video failed, see {log_path}"
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.time() - start, 2)
+    return result
+
+def run_batch(jobs, effect_paths, workers=None, encoder=None, log_dir=None):
+    """Render jobs in a process pool, splitting the CPU cores between the workers' ffmpeg threads"""
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, min(workers or cpu_count, len(jobs) or 1))
+    encoder_settings = get_encoder_settings(encoder)
+    # Each worker's x264 gets its share of the cores so the machine is busy but not oversubscribed
+    encoder_settings.threads = max(1, cpu_count // workers)
+    if log_dir:
+        Path(log_dir).mkdir(parents=True, exist_ok=True)
+
+    print(f"Rendering {len(jobs)} jobs with {workers} workers ({encoder_settings.threads} encoder threads each)")
+    results = []
+    crashed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_job, job, effect_paths, encoder_settings, log_dir): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory); every job still in the pool is affected
+                crashed.append(job)
+                continue
+            results.append(result)
+            _print_result(result, len(results), len(jobs))
+
+    # Re-run the jobs caught in a crashed pool one at a time, so one bad job can't take others down
+    for job in crashed:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            try:
+                result = pool.submit(render_job, job, effect_paths, encoder_settings, log_dir).result()
+            except BrokenProcessPool:
+                result = {"name": job["name"], "image": str(job["image"]), "speech": str(job["speech"]),
+                          "output": str(job["output"]), "status": "failed",
+                          "error": "Worker process crashed", "seconds": None}
+        results.append(result)
+        _print_result(result, len(results), len(jobs))
+
+    order = {job["name"]: idx for idx, job in enumerate(jobs)}
+    results.sort(key=lambda r: order.get(r["name"], 0))
+    return results
+
+def _print_result(result, done, total):
+    status = "✅" if result["status"] == "ok" else "❌"
+    detail = f"{result['seconds']}s" if result["status"] == "ok" else result["error"]
+    print(f"[{done}/{total}] {status} {result['name']}: {detail}")
+
+def write_report(results, report_path):
+    report = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "total": len(results),
+        "succeeded": sum(1 for r in results if r["status"] == "ok"),
+        "failed": sum(1 for r in results if r["status"] != "ok"),
+        "jobs": results,
+    }
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render many (image, speech) pairs into videos")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--jobs", help="JSON file with a list of {\"image\", \"speech\", \"output\"} jobs")
+    source.add_argument("--dir", help="Directory whose subdirectories each hold one image and one speech")
+    parser.add_argument("--workers", type=int, default=None, help="Number of parallel renders (default: CPU count)")
+    parser.add_argument("--encoder", choices=sorted(ENCODER_PRESETS), default="default",
+                        help="x264 encoder preset")
+    parser.add_argument("--report", default=None, help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    try:
+        print("\n" + "="*50)
+        print("STEP 1: COLLECTING JOBS")
+        print("="*50)
+        if args.jobs:
+            jobs = load_jobs_file(args.jobs)
+        elif args.dir:
+            jobs = find_jobs_in_directory(args.dir)
+        else:
+            # Default: runs in results/runs with an image and a speech but no video yet
+            jobs = find_pending_results()
+
+        if not jobs:
+            print("No jobs to render. Exiting.")
+            sys.exit(0)
+        print(f"Found {len(jobs)} jobs")
+
+        print("\n" + "="*50)
+        print("STEP 2: FINDING VIDEO EFFECTS")
+        print("="*50)
+        effect_paths = get_effect_paths()
+
+        print("\n" + "="*50)
+        print("STEP 3: RENDERING VIDEOS")
+        print("="*50)
+        results = run_batch(jobs, effect_paths, workers=args.workers, encoder=args.encoder)
+
+        report_path = Path(args.report) if args.report else \
+            BATCH_DIR / f"batch_report_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        report = write_report(results, report_path)
+
+        print("\n" + "="*50)
+        print("BATCH RENDER COMPLETE!")
+        print("="*50)
+        print(f"Succeeded: {report['succeeded']}, failed: {report['failed']}")
+        print(f"Report saved to: {report_path}")
+        print("="*50 + "\n")
+
+        sys.exit(0 if report["failed"] == 0 else 1)
+
+    except Exception as e:
+        print(f"\nUnexpected error: {e}")
+        traceback.print_exc()
+        sys.exit(1)
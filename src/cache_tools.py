@@ -0,0 +1,120 @@
+from pathlib import Path
+import os
+import json
+import time
+import hashlib
+import threading
+import traceback
+
+# Temporary files older than this were left behind by a crashed render (or a mapped partial stack)
+STALE_TMP_SECONDS = 24 * 3600
+
+def writer_id():
+    """Process and thread id, so the temporary files of renders running at the same time never clash"""
+    return f"{os.getpid()}-{threading.get_ident()}"
+
+def publish(tmp_path, path):
+    """Move a finished temporary file into place atomically, so concurrent renders never see a partial entry"""
+    os.replace(tmp_path, path)
+
+def touch(path):
+    """Mark an entry (its data file or its metadata) as recently used for LRU eviction; False if it
+    was evicted in the meantime"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    except Exception as e:
+        print(f"Error reading {path}: {e}")
+        traceback.print_exc()
+        return None
+
+def write_json(path, data):
+    tmp_path = path.with_name(f"{path.name}.{writer_id()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    publish(tmp_path, path)
+
+def file_hash(path, cache_dir):
+    """SHA-256 of a file, memoized in cache_dir by path, size and modification time"""
+    path = Path(path).resolve()
+    stat = path.stat()
+    memo_path = Path(cache_dir) / "hashes.json"
+    memo = read_json(memo_path) or {}
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    entry = memo.get(str(path))
+    if entry and entry["stamp"] == stamp:
+        return entry["sha256"]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    memo[str(path)] = {"stamp": stamp, "sha256": digest.hexdigest()}
+    write_json(memo_path, memo)
+    return digest.hexdigest()
+
+def remove_entry(path, label="entry"):
+    """Delete a cache entry: its data file and its metadata (the .json next to it), if any"""
+    for entry_path in (Path(path), Path(path).with_suffix(".json")):
+        try:
+            entry_path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # Another render may still have it open or mapped (Windows)
+            print(f"Could not remove cached {label} {entry_path.name}: {e}")
+
+def evict(cache_dir, pattern, max_bytes, keep=(), label="entry"):
+    """Delete the least recently used entries (data files matching pattern, keyed by their stem)
+    until the cache fits in max_bytes.
+
+    An entry was last used when its metadata (or, without one, its data file) was last touched.
+    The keys in keep are never deleted. Temporary files left behind by crashed renders are removed
+    once they are stale.
+    """
+    cache_dir = Path(cache_dir)
+    now = time.time()
+    for tmp_path in cache_dir.glob("*.tmp*"):
+        try:
+            if now - tmp_path.stat().st_mtime > STALE_TMP_SECONDS:
+                tmp_path.unlink()
+        except OSError:
+            # Gone already, or still mapped by a running render (Windows)
+            pass
+
+    entries = []
+    for path in cache_dir.glob(pattern):
+        if ".tmp" in path.name:
+            continue
+        # Another render may evict the entry at any point of the scan
+        try:
+            size = path.stat().st_size
+        except OSError:
+            continue
+        try:
+            last_used = path.with_suffix(".json").stat().st_mtime
+        except OSError:
+            try:
+                last_used = path.stat().st_mtime
+            except OSError:
+                continue
+        entries.append((last_used, path, size))
+
+    total = sum(size for _, _, size in entries)
+    for last_used, path, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path.stem in keep:
+            continue
+        print(f"Evicting cached {label} {path.stem}")
+        remove_entry(path, label)
+        total -= size
@@ -0,0 +1,122 @@
+from pathlib import Path
+import hashlib
+import numpy as np
+
+# Rec. 709 luma weights, used for saturation
+LUMA_WEIGHTS = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+def load_cube_lut(path):
+    """Read a 3D LUT in the .cube format: an (N, N, N, 3) float32 array indexed [b, g, r] and
+    the input domain (min and max RGB)"""
+    size = None
+    domain_min = np.zeros(3, dtype=np.float32)
+    domain_max = np.ones(3, dtype=np.float32)
+    values = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split()
+            if parts[0] == "LUT_3D_SIZE":
+                size = int(parts[1])
+            elif parts[0] == "DOMAIN_MIN":
+                domain_min = np.array(parts[1:4], dtype=np.float32)
+            elif parts[0] == "DOMAIN_MAX":
+                domain_max = np.array(parts[1:4], dtype=np.float32)
+            elif parts[0] == "LUT_3D_INPUT_RANGE":
+                # Resolve's form of the domain: one min and max for all channels
+                domain_min = np.full(3, float(parts[1]), dtype=np.float32)
+                domain_max = np.full(3, float(parts[2]), dtype=np.float32)
+            elif parts[0] == "LUT_1D_SIZE":
+                raise ValueError(f"{path} is a 1D LUT, only 3D LUTs are supported")
+            elif parts[0][0].isalpha():
+                # TITLE and the keywords of other tools don't change the table
+                if parts[0] != "TITLE":
+                    print(f"Skipping unknown keyword {parts[0]} in {path}")
+            elif len(parts) == 3:
+                values.append([float(v) for v in parts])
+            else:
+                raise ValueError(f"{path}: expected 3 values per table row, got '{line}'")
+    if size is None or len(values) != size ** 3:
+        raise ValueError(f"{path} is not a valid 3D .cube LUT")
+    # The red index changes fastest in the file
+    lut = np.array(values, dtype=np.float32).reshape(size, size, size, 3)
+    return lut, domain_min, domain_max
+
+class ColorGrade:
+    """Exposure (in stops), gamma, saturation and an optional 3D LUT for uint8 RGB images.
+
+    Exposure and gamma act on each channel separately, so they are folded into one 256-entry
+    table; saturation and the LUT are vectorized over the whole image. Meant to be applied
+    once per source (the image, each cached overlay frame), never per rendered frame.
+    """
+
+    def __init__(self, exposure=0.0, gamma=1.0, saturation=1.0, lut_path=None):
+        if gamma <= 0:
+            raise ValueError(f"Gamma must be greater than 0, got {gamma}")
+        self.exposure = exposure
+        self.gamma = gamma
+        self.saturation = saturation
+        self.lut_path = str(lut_path) if lut_path else None
+        self.lut = None
+        if lut_path:
+            self.lut, self.lut_min, self.lut_max = load_cube_lut(lut_path)
+        self.lut_hash = hashlib.sha256(Path(lut_path).read_bytes()).hexdigest() if lut_path else None
+
+        levels = np.arange(256, dtype=np.float64) / 255.0
+        toned = np.clip(levels * 2.0 ** exposure, 0.0, 1.0) ** (1.0 / gamma)
+        self.tone_table = np.clip(toned * 255.0 + 0.5, 0, 255).astype(np.uint8)
+
+    @property
+    def is_identity(self):
+        return self.exposure == 0 and self.gamma == 1 and self.saturation == 1 and self.lut is None
+
+    def signature(self):
+        """Everything that changes the result, for cache keys"""
+        return [self.exposure, self.gamma, self.saturation, self.lut_hash]
+
+    def apply(self, rgb):
+        """Graded copy of an HxWx3 uint8 image"""
+        graded = np.take(self.tone_table, rgb)
+        if self.saturation == 1 and self.lut is None:
+            return graded
+
+        values = graded.astype(np.float32)
+        if self.saturation != 1:
+            luma = values @ LUMA_WEIGHTS
+            values -= luma[..., None]
+            values *= np.float32(self.saturation)
+            values += luma[..., None]
+            np.clip(values, 0, 255, out=values)
+        values /= 255.0
+        if self.lut is not None:
+            values = self._apply_lut(values)
+        return np.clip(values * 255.0 + 0.5, 0, 255).astype(np.uint8)
+
+    def _apply_lut(self, values):
+        """Trilinear interpolation in the 3D LUT for float RGB values in [0, 1]"""
+        size = self.lut.shape[0]
+        flat_lut = self.lut.reshape(-1, 3)
+        position = (values - self.lut_min) / (self.lut_max - self.lut_min) * np.float32(size - 1)
+        index = np.clip(np.floor(position).astype(np.int32), 0, size - 2)
+        fraction = np.clip(position - index, 0.0, 1.0)
+        # Flat index of the lower corner of each pixel's cell; the other corners are fixed offsets
+        base = (index[..., 2] * size + index[..., 1]) * size + index[..., 0]
+        fr, fg, fb = fraction[..., 0:1], fraction[..., 1:2], fraction[..., 2:3]
+        out = np.zeros_like(values)
+        for db, wb in ((0, 1 - fb), (size * size, fb)):
+            for dg, wg in ((0, 1 - fg), (size, fg)):
+                weight = wb * wg
+                for dr, wr in ((0, 1 - fr), (1, fr)):
+                    out += np.take(flat_lut, base + (db + dg + dr), axis=0) * (weight * wr)
+        return out
+
+def get_color_grade(grade=None):
+    """Accept a ColorGrade, a dict of ColorGrade arguments or None (no grading)"""
+    if grade is None:
+        return None
+    if not isinstance(grade, ColorGrade):
+        grade = ColorGrade(**grade)
+    # An identity grade is skipped altogether (and keeps the cache keys of ungraded overlays)
+    return None if grade.is_identity else grade
@@ -0,0 +1,193 @@
+import numpy as np
+
+# Height of the row bands transparent overlay areas are skipped in
+ROW_BAND = 16
+
+def center_offset(outer, inner):
+    """Offset that centers a length `inner` inside `outer` (moviepy 'center' rounding)"""
+    return int((outer - inner) / 2)
+
+def blit_regions(canvas_w, canvas_h, frame_w, frame_h, x, y):
+    """Return (dst, src) slice pairs for drawing a frame at (x, y), clipped to the canvas"""
+    x1, y1 = max(x, 0), max(y, 0)
+    x2, y2 = min(x + frame_w, canvas_w), min(y + frame_h, canvas_h)
+    if x2 <= x1 or y2 <= y1:
+        return None, None
+    dst = (slice(y1, y2), slice(x1, x2))
+    src = (slice(y1 - y, y2 - y), slice(x1 - x, x2 - x))
+    return dst, src
+
+def active_rows(alpha, band=ROW_BAND):
+    """(y0, y1) runs of the rows of an alpha plane that have any visible pixel, in bands of `band`
+    rows. Blending can skip everything else, where the layer is fully transparent."""
+    height = alpha.shape[0]
+    occupied = alpha.reshape(height, -1).any(axis=1)
+    bands = np.logical_or.reduceat(occupied, np.arange(0, height, band)).astype(np.int8)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], bands, [0]))))
+    return [(int(start * band), int(min(end * band, height))) for start, end in zip(edges[::2], edges[1::2])]
+
+class FrameCompositor:
+    """Blends one image layer and N full-frame overlays onto a fixed-size canvas.
+
+    All math is done in uint8/uint16 with preallocated buffers, so composing a
+    frame allocates nothing. The returned frame is the internal canvas and is
+    overwritten by the next call to compose_layer() or compose_over().
+    """
+
+    def __init__(self, width=1080, height=1920, background=(0, 0, 0)):
+        self.width = width
+        self.height = height
+        self.background = np.array(background, dtype=np.uint8)
+        self.canvas = np.empty((height, width, 3), dtype=np.uint8)
+        # Scratch buffers for the blends
+        self._acc = np.empty((height, width, 3), dtype=np.uint16)
+        self._tmp = np.empty((height, width, 3), dtype=np.uint16)
+        self._scratch = np.empty((height, width, 3), dtype=np.uint16)
+        self._inv_alpha = np.empty((height, width), dtype=np.uint8)
+
+    def compose_layer(self, layer, x, y, overlays=(), premultiplied=False):
+        """Compose one frame from a premultiplied RGBA layer with its top-left corner at (x, y)
+        (e.g. the box a transformed image covers), followed by the overlays (see _draw_overlays)"""
+        canvas = self.canvas
+        self._fill_background()
+        if layer is not None:
+            if not self.background.any():
+                # Premultiplied color over black is the color itself
+                dst, src = blit_regions(self.width, self.height, layer.shape[1], layer.shape[0], x, y)
+                if dst is not None:
+                    canvas[dst] = layer[src][..., :3]
+            else:
+                self._draw_premultiplied(layer, 255, x, y)
+        self._draw_overlays(overlays, premultiplied)
+        return canvas
+
+    def compose_over(self, base, overlays=(), premultiplied=False, x=0, y=0):
+        """Blend overlays over an already composed canvas-sized frame (e.g. a cached static frame),
+        optionally shifted by (x, y) pixels with the background showing at the uncovered edges"""
+        if x == 0 and y == 0:
+            np.copyto(self.canvas, base)
+        else:
+            self._fill_background()
+            dst, src = blit_regions(self.width, self.height, self.width, self.height, x, y)
+            if dst is not None:
+                self.canvas[dst] = base[src]
+        self._draw_overlays(overlays, premultiplied)
+        return self.canvas
+
+    def _fill_background(self):
+        if self.background.any():
+            self.canvas[...] = self.background
+        else:
+            # Much faster than broadcasting the background color
+            self.canvas.fill(0)
+
+    def _draw_overlays(self, overlays, premultiplied):
+        """Blend the overlays over the canvas, in order.
+
+        overlays: iterable of (frame, opacity) or (frame, opacity, rows) tuples. A frame is
+            HxWx3 or HxWx4 uint8 and is centered (cropped if it is larger than the canvas).
+            Opacity is a float in [0, 1] that scales the frame's own alpha. rows (from
+            active_rows) limits a premultiplied frame's blend to the rows it covers.
+        premultiplied: overlay frames are RGBA with color already multiplied by alpha
+            (e.g. a flattened overlay stack).
+        """
+        for overlay in overlays:
+            frame, opacity = overlay[:2]
+            rows = overlay[2] if len(overlay) > 2 else None
+            if frame is None:
+                continue
+            if premultiplied and rows is not None:
+                x = center_offset(self.width, frame.shape[1])
+                y = center_offset(self.height, frame.shape[0])
+                for y0, y1 in rows:
+                    self._draw_premultiplied(frame[y0:y1], int(round(opacity * 255)), x, y + y0)
+            elif premultiplied:
+                self._draw_premultiplied(frame, int(round(opacity * 255)))
+            elif frame.ndim == 3 and frame.shape[2] == 4:
+                self._draw(frame[..., :3], int(round(opacity * 255)), frame[..., 3])
+            else:
+                self._draw(frame, int(round(opacity * 255)), None)
+
+    def _draw(self, frame, opacity, alpha):
+        """Blend a frame centered on the canvas with a constant opacity (0-255) and optional alpha plane"""
+        frame_h, frame_w = frame.shape[:2]
+        x = center_offset(self.width, frame_w)
+        y = center_offset(self.height, frame_h)
+        dst, src = blit_regions(self.width, self.height, frame_w, frame_h, x, y)
+        if dst is None or opacity <= 0:
+            return
+
+        region = self.canvas[dst]
+        frame = frame[src]
+
+        # Fully opaque layer: plain copy
+        if alpha is None and opacity >= 255:
+            region[...] = frame
+            return
+
+        acc = self._acc[dst]
+        tmp = self._tmp[dst]
+        if alpha is None:
+            # out = (frame * a + region * (255 - a)) / 255
+            np.multiply(region, 255 - opacity, out=acc, dtype=np.uint16)
+            np.multiply(frame, opacity, out=tmp, dtype=np.uint16)
+        else:
+            alpha = alpha[src]
+            inv = self._inv_alpha[dst]
+            if opacity < 255:
+                # Scale the alpha plane by the layer opacity (kept in the inverse-alpha buffer)
+                np.multiply(alpha, opacity, out=tmp[..., 0], dtype=np.uint16)
+                _div255(tmp[..., 0], tmp[..., 1])
+                np.copyto(inv, tmp[..., 0], casting="unsafe")
+                alpha = inv
+            np.multiply(frame, alpha[..., None], out=tmp, dtype=np.uint16)
+            np.subtract(255, alpha, out=inv, dtype=np.uint8)
+            np.multiply(region, inv[..., None], out=acc, dtype=np.uint16)
+
+        acc += tmp
+        _div255(acc, tmp)
+        np.copyto(region, acc, casting="unsafe")
+
+    def _draw_premultiplied(self, frame, opacity, x=None, y=None):
+        """Blend a premultiplied RGBA frame (centered unless x, y are given):
+        out = color + canvas * (255 - alpha) / 255"""
+        frame_h, frame_w = frame.shape[:2]
+        if x is None:
+            x = center_offset(self.width, frame_w)
+            y = center_offset(self.height, frame_h)
+        dst, src = blit_regions(self.width, self.height, frame_w, frame_h, x, y)
+        if dst is None or opacity <= 0:
+            return
+
+        region = self.canvas[dst]
+        frame = frame[src]
+        acc = self._acc[dst]
+        tmp = self._tmp[dst]
+        inv = self._inv_alpha[dst]
+
+        if opacity < 255:
+            # Scale the alpha plane by the layer opacity
+            np.multiply(frame[..., 3], opacity, out=acc[..., 0], dtype=np.uint16)
+            _div255(acc[..., 0], tmp[..., 0])
+            np.subtract(255, acc[..., 0], out=inv, casting="unsafe")
+        else:
+            np.subtract(255, frame[..., 3], out=inv, dtype=np.uint8)
+
+        # Background contribution, then add the (scaled) premultiplied color
+        np.multiply(region, inv[..., None], out=acc, dtype=np.uint16)
+        _div255(acc, tmp)
+        if opacity < 255:
+            np.multiply(frame[..., :3], opacity, out=tmp, dtype=np.uint16)
+            _div255(tmp, self._scratch[dst])
+            acc += tmp
+        else:
+            acc += frame[..., :3]
+        np.minimum(acc, 255, out=acc)
+        np.copyto(region, acc, casting="unsafe")
+
+def _div255(values, scratch):
+    """In-place floor division of uint16 values in [0, 65025] by 255, without a true divide"""
+    values += 1
+    np.right_shift(values, 8, out=scratch)
+    values += scratch
+    values >>= 8
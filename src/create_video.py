@@ -2,15 +2,30 @@ from pathlib import Path
 import os
 import sys
 import time
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import tempfile
+import hashlib
+import re
+import copy
 import traceback
-import requests
-import urllib.request
-from pydub import AudioSegment
-import moviepy.editor as mp
 from PIL import Image
 import numpy as np
-
-#TODO: fix the brightness of the video.
+from compositor import FrameCompositor, center_offset
+from ffmpeg_tools import (ENCODER_PRESETS, OutputProfile, get_encoder_settings, get_output_profile, write_frames,
+                          encode_still_segment, concat_segments)
+from cache_tools import file_hash
+from overlay_cache import load_overlay_stack, source_hash
+from audio_loader import NarrationAudio
+from render_profile import RenderProfiler, NULL_PROFILER
+from animation import ANIMATION_PRESETS, AudioReactive, AffineAnimation, affine_coefficients, get_animation
+from frame_pool import FramePool, choose_worker_count
+from color_grade import get_color_grade
+from image_cache import prepare_image
+from overlay_decoder import sequence_frames
+from segment_cache import get_segment_cache
+from runs import get_run
 
 def find_effects():
     """Find all video effect overlays in the effects directory"""
@@ -25,6 +40,12 @@ def find_effects():
     for ext in video_extensions:
         effect_files.extend(list(effects_dir.glob(f"*{ext}")))
     
+    # A subdirectory of PNG frames is a PNG sequence effect (one image per video frame)
+    effect_files.extend(d for d in effects_dir.iterdir() if d.is_dir() and sequence_frames(d))
+    
+    # Effects are stacked in alphabetical order by filename
+    effect_files.sort(key=lambda x: x.name)
+    
     if effect_files:
         print(f"Found {len(effect_files)} effect files:")
         for effect in effect_files:
@@ -75,199 +96,506 @@ def download_fire_effect():
         traceback.print_exc()
         return None
 
-def find_latest_files():
-    print("Finding latest generated files...")
+def get_effect_paths():
+    """Effects to apply: the ones in the effects directory, or the fire effect if there are none"""
+    effect_paths = find_effects()
+    
+    # If no effects found, check for fire effect as fallback
+    if not effect_paths:
+        print("No effects found. Checking for fire effect...")
+        fire_effect_path = download_fire_effect()
+        if fire_effect_path and fire_effect_path.exists():
+            effect_paths = [fire_effect_path]
+    return effect_paths
+
+def find_run_files(run):
+    """The speech and image of a run (None when one is missing)"""
+    print(f"Finding the files of run {run.run_id}...")
     try:
-        # Find latest speech file
-        speeches_dir = Path(__file__).parent.parent / "results/speeches"
-        print(f"Looking for speech files in: {speeches_dir.resolve()}")
-        speech_files = list(speeches_dir.glob("speech_*.mp3"))
-        if not speech_files:
-            print("No speech files found.")
+        if not run.speech_path.exists():
+            print(f"No speech file found at {run.speech_path}")
             return None, None
-        latest_speech = max(speech_files, key=lambda x: int(x.stem.split('_')[1]))
-        
-        # Find latest image file
-        images_dir = Path(__file__).parent.parent / "results/images"
-        image_files = list(images_dir.glob("image_*.png"))
-        if not image_files:
-            # Try character_reference.png if no numbered images found
-            character_ref = images_dir / "character_reference.png"
-            if character_ref.exists():
-                latest_image = character_ref
-            else:
-                print("No image files found.")
-                return latest_speech, None
-        else:
-            latest_image = max(image_files, key=lambda x: int(x.stem.split('_')[1]))
         
-        print(f"Found latest speech: {latest_speech}")
-        print(f"Found latest image: {latest_image}")
+        # No fallback to a shared image: the video must show this run's character
+        if not run.image_path.exists():
+            print(f"No image file found at {run.image_path}. "
+                  f"Generate it with: python src/generate_image.py --run-id {run.run_id}")
+            return run.speech_path, None
         
-        return latest_speech, latest_image
+        print(f"Found speech: {run.speech_path}")
+        print(f"Found image: {run.image_path}")
+        
+        return run.speech_path, run.image_path
     except Exception as e:
-        print(f"Error finding latest files: {e}")
+        print(f"Error finding the run's files: {e}")
         traceback.print_exc()
         return None, None
 
-def apply_grow_and_turn_effect(clip, total_duration, animation_duration=2.0):
-    """Apply a grow and turn effect (similar to PowerPoint) to the clip"""
-    print("Applying grow and turn effect to image...")
+def apply_animation(image, transforms, canvas_size, center):
+    """Turn the per-frame (scale, rotation, x, y) tables of a compiled Animation into one affine
+    matrix per frame. Translations are fractions of the canvas, so an animation looks the same
+    at any resolution."""
+    scale, rotation, x, y = transforms
+    centers = (center[0] + x * canvas_size[0], center[1] + y * canvas_size[1])
+    # One matrix per frame, so each frame is a single resample of the image into the canvas
+    return AffineAnimation(image, canvas_size, affine_coefficients(scale, rotation, image.size, centers))
+
+DEFAULT_FPS = 24
+# After the intro, an audio-reactive image is drawn from this many pre-rendered pulse levels
+PULSE_LEVELS = 16
+
+def brighten(layer, gain):
+    """Copy of a premultiplied RGBA layer with its color multiplied by gain (one table lookup per pixel)"""
+    table = np.clip(np.arange(256) * gain + 0.5, 0, 255).astype(np.uint8)
+    brightened = table[layer]
+    brightened[..., 3] = layer[..., 3]
+    # Premultiplied color can't exceed its alpha
+    np.minimum(brightened, layer[..., 3:], out=brightened)
+    return brightened
+
+class FrameSource:
+    """Composited frames of one video, addressed by frame index.
     
-    # Define the animation duration (in seconds)
-    # If animation_duration is too long compared to total_duration, reduce it
-    if animation_duration > total_duration / 3:
-        animation_duration = total_duration / 3
+    Everything needed to render any frame range is rebuilt from plain arguments, so
+    worker processes can construct their own FrameSource for the segment they render.
+    """
     
-    # For grow effect, we'll use a resize function that changes with time
-    def grow_effect(t):
-        if t < animation_duration:
-            progress = t / animation_duration  # 0 to 1 during animation
-            scale = 0.5 + 0.5 * progress  # Start at 0.5x size, end at 1x size
-            return scale
-        else:
-            return 1.0  # Full size after animation
+    def __init__(self, image_path, total_duration, effect_paths=None, use_grow_and_turn=True,
+                 fps=DEFAULT_FPS, target_width=1080, target_height=1920, effect_opacity=0.2, profiler=None,
+                 animation=None, grade=None, reactive=None):
+        self.profiler = profiler or NULL_PROFILER
+        self.image_path = Path(image_path)
+        self.effect_opacity = effect_opacity
+        self.fps = fps
+        self.width = target_width
+        self.height = target_height
+        self.total_frames = int(np.ceil(total_duration * fps))
+        
+        # Load the render-ready image: decoded and scaled to fit the target dimensions (keeping
+        # the aspect ratio, black bars where needed) once, then memory-mapped from the cache
+        with self.profiler.timed("image_load"):
+            pixels = prepare_image(image_path, target_width, target_height)
+            image = Image.fromarray(np.array(pixels), "RGBA")
+        new_width, new_height = image.size
+        
+        # Color grading (exposure, gamma, saturation, LUT) is applied once to the source image
+        # and once to each cached overlay frame, never to the rendered frames
+        grade = self.grade = get_color_grade(grade)
+        if grade is not None:
+            with self.profiler.timed("color_grade"):
+                pixels = np.array(image)
+                pixels[..., :3] = grade.apply(pixels[..., :3])
+                image = Image.fromarray(pixels, "RGBA")
+        # Premultiplied RGBA of the image at rest, drawn centered for the static hold
+        self.image_layer = np.asarray(image.convert("RGBa"))
+        self.image_position = (center_offset(target_width, new_width), center_offset(target_height, new_height))
+        
+        # Animate the image: a preset name or Animation (grow and turn unless it is turned off)
+        if animation is None and use_grow_and_turn:
+            animation = "grow_and_turn"
+        animation = get_animation(animation, total_duration)
+        
+        # The video is an animated part followed by a static hold: once the animation
+        # ends, the image on the background never changes again
+        animation_end = animation.end if animation is not None else 0.0
+        self.intro_frames = min(int(np.ceil(animation_end * fps)), self.total_frames)
+        self.animation = None
+        self.hold_animated = False
+        self.brightness = None
+        self.reactive = reactive
+        if reactive is not None and animation is not None:
+            # The narration also drives the intro, through its per-frame transforms
+            animation = copy.copy(animation)
+            animation.reactive = reactive
+        if animation is not None:
+            print(f"Animating the image for {self.intro_frames / fps:.2f} seconds...")
+            # The animation moves the image around its center at rest. The table has one extra
+            # frame, the pose the animation ends in, which the static hold is drawn from
+            center = (self.image_position[0] + new_width / 2, self.image_position[1] + new_height / 2)
+            transforms = animation.compile(self.intro_frames + 1, fps)
+            self.animation = apply_animation(image, transforms, (target_width, target_height), center)
+            self.brightness = animation.brightness(self.intro_frames + 1, fps)
+            scale, rotation, x, y = (values[-1] for values in transforms)
+            # An animation that ends with the image at rest holds the exact image instead of a resample
+            self.hold_animated = not (scale == 1.0 and rotation % 360 == 0 and x == 0 and y == 0)
+        
+        if reactive is not None:
+            # After the intro the image pulses with the narration. The level of each frame is
+            # quantized to PULSE_LEVELS, and each level's frame (scaled and brightened image on the
+            # background) is composed once on first use, so a frame costs a lookup and a copy like
+            # the static hold; the shake is a whole-pixel shift of that copy
+            steps = np.arange(PULSE_LEVELS + 1) / PULSE_LEVELS
+            zeros = np.zeros_like(steps)
+            center = (self.image_position[0] + new_width / 2, self.image_position[1] + new_height / 2)
+            self.pulse = apply_animation(image, (1.0 + reactive.scale * steps, zeros, zeros, zeros),
+                                         (target_width, target_height), center)
+            times = np.arange(self.total_frames) / fps
+            self.pulse_levels = np.round(reactive.sample(times) * PULSE_LEVELS).astype(np.int64)
+            dx, dy = reactive.offsets(times)
+            self.pulse_offsets = np.round(np.stack([dx * target_width, dy * target_height], axis=-1)).astype(np.int64)
+            self._pulse_frames = {}
+        
+        # Add effects if available: the whole stack is flattened into a single premultiplied
+        # RGBA track (cached), so each frame needs one overlay blend however many effects there are
+        self.overlay_track = None
+        if effect_paths:
+            existing_effects = [Path(effect_path) for effect_path in effect_paths if Path(effect_path).exists()]
+            if existing_effects:
+                try:
+                    with self.profiler.timed("effect_load"):
+                        self.overlay_track = load_overlay_stack(existing_effects,
+                                                                [effect_opacity] * len(existing_effects),
+                                                                target_width, target_height, fps, self.total_frames,
+                                                                grade=grade)
+                except Exception as e:
+                    print(f"Error adding effects: {e}. Skipping effects.")
+                    traceback.print_exc()
+        
+        # Blend the image and all effects on a black background with the NumPy compositor
+        self.compositor = FrameCompositor(target_width, target_height, background=(0, 0, 0))
+        
+        # The hold frame (image on background) is rendered once and reused for every later frame
+        self.hold_frame = self._compose_image(self.intro_frames).copy()
     
-    # For rotation effect, we'll use a rotate function that changes with time
-    def rotate_effect(t):
-        if t < animation_duration:
-            progress = t / animation_duration  # 0 to 1 during animation
-            angle = 360 * progress  # Full rotation during animation
-            return angle
+    def signature(self, cache_dir):
+        """Everything the rendered frames depend on (image, animation, effects, grade, size), for
+        the keys of cached segments; cache_dir holds the memo of file hashes"""
+        animation = None
+        if self.animation is not None:
+            matrices = np.ascontiguousarray(self.animation.matrices)
+            animation = [hashlib.sha256(matrices.tobytes()).hexdigest(), self.intro_frames, self.hold_animated]
+            if self.brightness is not None:
+                animation.append(hashlib.sha256(self.brightness.tobytes()).hexdigest())
+        pulse = None
+        if self.reactive is not None:
+            pulse = [self.reactive.scale, self.reactive.brightness, PULSE_LEVELS,
+                     hashlib.sha256(self.pulse_levels.tobytes() + self.pulse_offsets.tobytes()).hexdigest()]
+        # Only the effects that actually made it into the stack
+        effects = []
+        if self.overlay_track is not None:
+            effects = [[source_hash(path, cache_dir), self.effect_opacity] for path in self.overlay_track.source]
+        return {"image": file_hash(self.image_path, cache_dir), "size": [self.width, self.height], "fps": self.fps,
+                "animation": animation, "pulse": pulse, "effects": effects,
+                "grade": self.grade.signature() if self.grade is not None else None}
+    
+    @property
+    def animated_frames(self):
+        """Number of leading frames that need per-frame compositing"""
+        return self.intro_frames if self.static_hold else self.total_frames
+    
+    @property
+    def static_hold(self):
+        """True if every frame after the intro is the same (no overlays, no audio-reactive pulse)"""
+        return self.overlay_track is None and self.reactive is None
+    
+    def _compose_image(self, index, overlays=()):
+        if index < self.intro_frames or self.hold_animated:
+            with self.profiler.timed("image_transform"):
+                layer, x, y = self.animation.frame(min(index, self.intro_frames))
+                if self.brightness is not None and layer is not None:
+                    layer = brighten(layer, self.brightness[min(index, self.intro_frames)])
         else:
-            return 0  # No rotation after animation
+            layer, (x, y) = self.image_layer, self.image_position
+        with self.profiler.timed("composite"):
+            return self.compositor.compose_layer(layer, x, y, overlays, premultiplied=True)
+    
+    def _pulse_frame(self, level):
+        """Image on the background at a pulse level, composed on first use"""
+        frame = self._pulse_frames.get(level)
+        if frame is None:
+            with self.profiler.timed("image_transform"):
+                if level == 0:
+                    # At rest: the exact image, no resample
+                    layer, (x, y) = self.image_layer, self.image_position
+                else:
+                    layer, x, y = self.pulse.frame(level)
+                    if self.reactive.brightness and layer is not None:
+                        layer = brighten(layer, 1.0 + self.reactive.brightness * level / PULSE_LEVELS)
+                frame = self._pulse_frames[level] = self.compositor.compose_layer(layer, x, y).copy()
+        return frame
     
-    # Apply custom effects in sequence
-    # First apply dynamic resizing
-    resized_clip = clip.fx(mp.vfx.resize, lambda t: grow_effect(t))
+    def _compose_pulse(self, index, overlays=()):
+        base = self._pulse_frame(int(self.pulse_levels[index]))
+        dx, dy = self.pulse_offsets[index]
+        with self.profiler.timed("composite"):
+            return self.compositor.compose_over(base, overlays, premultiplied=True, x=int(dx), y=int(dy))
     
-    # Then apply rotation
-    final_clip = resized_clip.fx(mp.vfx.rotate, lambda t: rotate_effect(t))
+    def frame(self, index):
+        """Composited frame at a frame index (the returned array is reused by the next call)"""
+        overlays = []
+        if self.overlay_track is not None:
+            # Transparent row bands of the overlay frame are not blended at all
+            overlays = [(self.overlay_track.frame(index), 1.0, self.overlay_track.active_rows(index))]
+        if index >= self.intro_frames and self.reactive is not None:
+            return self._compose_pulse(index, overlays)
+        if index >= self.intro_frames:
+            with self.profiler.timed("composite"):
+                return self.compositor.compose_over(self.hold_frame, overlays, premultiplied=True)
+        return self._compose_image(index, overlays)
     
-    return final_clip
+    def frames(self, start, end):
+        for index in range(start, end):
+            yield self.frame(index)
+    
+    def close(self):
+        self.animation = None
+
+def choose_segment_count(n_frames, fps, cpu_count=None, min_segment_seconds=1.0):
+    """Number of parallel segments for n_frames: one per core, but no segment shorter than min_segment_seconds"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    min_segment_frames = max(1, int(fps * min_segment_seconds))
+    return max(1, min(cpu_count, n_frames // min_segment_frames))
+
+def split_segments(n_frames, n_segments, keyframe_interval):
+    """Split [0, n_frames) into at most n_segments ranges whose boundaries fall on keyframes"""
+    n_gops = max(1, int(np.ceil(n_frames / keyframe_interval)))
+    n_segments = max(1, min(n_segments, n_gops))
+    boundaries = [min(n_frames, round(n_gops * i / n_segments) * keyframe_interval) for i in range(n_segments + 1)]
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+def segment_encoder_changes(encoder, n_segments):
+    """Encoder settings of one of n_segments segments encoded in parallel: a share of the threads
+    and, at a fixed bitrate, a one-second VBV buffer. Each x264 process rate-controls its own
+    segment, and short ABR encodes overshoot the target (a 5 s clip split in 3 came out 1.5x larger)."""
+    changes = dict(threads=max(1, (os.cpu_count() or 1) // n_segments))
+    if encoder.bitrate and not encoder.maxrate:
+        changes.update(maxrate=encoder.bitrate, bufsize=encoder.bitrate)
+    return changes
+
+def render_segment(source_args, start, end, segment_outputs):
+    """Worker entry point: build a FrameSource and encode frames [start, end) into every
+    OutputProfile of segment_outputs (one per output of the video)"""
+    source = FrameSource(**source_args)
+    try:
+        write_frames(source.frames(start, end), segment_outputs, source.width, source.height, source.fps)
+    finally:
+        source.close()
+    return [output.path for output in segment_outputs]
+
+def save_thumbnail(source, thumbnail_path, seconds=None):
+    """Save the composited frame at `seconds` (default: when the animation has settled) as an image"""
+    if seconds is None:
+        index = source.intro_frames
+    else:
+        index = int(round(seconds * source.fps))
+    index = min(max(index, 0), source.total_frames - 1)
+    thumbnail_path = Path(thumbnail_path)
+    print(f"Saving thumbnail at {index / source.fps:.2f} seconds to {thumbnail_path}...")
+    # The frame is composed like any other, no need to decode the finished video
+    Image.fromarray(source.frame(index)).save(thumbnail_path, quality=90)
+    return thumbnail_path
+
+# Draft render tier for quick QA: same composition at half size, half the frame rate
+PREVIEW_WIDTH = 540
+PREVIEW_HEIGHT = 960
+PREVIEW_FPS = 12
 
-def create_video(image_path, audio_path, output_path, effect_paths=None, use_grow_and_turn=True):
-    """Create a video with the image, audio, and all video effects"""
+def create_video(image_path, audio_path, output_path, effect_paths=None, use_grow_and_turn=True, encoder=None,
+                 segments=1, preview=False, max_seconds=None, profile=False, workers=1, window=None,
+                 animation=None, grade=None, outputs=None, thumbnail=None, thumbnail_time=None,
+                 cache_segments=True, audio_reactive=None):
+    """Create a video with the image, audio, and all video effects
+    
+    encoder: EncoderSettings, a preset name from ffmpeg_tools.ENCODER_PRESETS or None for the default
+    segments: number of segments rendered in parallel processes, or "auto" to pick it from the
+        video length and os.cpu_count()
+    preview: render a draft (540x960, 12 fps, "preview" encoder preset) with the same composition
+    max_seconds: only render the first max_seconds of the video
+    profile: write per-stage timings, frame rate and peak memory to <output>.profile.json
+    workers: number of processes producing the frames of a single encode, or "auto" (not used for
+        parallel segments, which already produce their frames in separate processes)
+    window: maximum number of frames in flight between the workers and the encoder (default 2 * workers)
+    animation: preset name from animation.ANIMATION_PRESETS or an animation.Animation
+        (default: grow and turn when use_grow_and_turn is set)
+    grade: color_grade.ColorGrade or a dict of its arguments (exposure, gamma, saturation, lut_path),
+        applied once to the image and to the cached overlay frames
+    outputs: extra ffmpeg_tools.OutputProfile (or dicts of its arguments: path, width, height, encoder,
+        container) encoded from the same frames as output_path, e.g. a 720p archive copy. Every
+        frame is composed once and ffmpeg splits and scales it for each output
+    thumbnail: path of a poster image of the frame at thumbnail_time seconds (default: the first
+        frame after the animation)
+    cache_segments: reuse and store encoded intro and hold segments in the segment cache (True,
+        a segment_cache.SegmentCache or a directory), so a render that only changes the narration
+        just encodes what is missing and muxes the new audio; False renders everything
+    audio_reactive: make the image pulse with the narration: True, or a dict of animation.AudioReactive
+        arguments (scale, brightness, shake, frequency) plus drive ("rms" for loudness, "onset" for
+        the start of words). The envelope is computed once from the narration for every frame
+    """
     print("Creating video...")
+    profiler = RenderProfiler() if profile else NULL_PROFILER
     try:
-        # Get audio duration
-        audio = AudioSegment.from_file(str(audio_path))
-        total_duration = len(audio) / 1000.0  # Convert to seconds
+        # Get audio duration from the container header; PCM is only decoded if something needs samples
+        with profiler.timed("audio_probe"):
+            audio = NarrationAudio(audio_path)
+        total_duration = audio.duration
         
         print(f"Audio duration: {total_duration:.2f} seconds")
         
-        # Load the image
-        img = Image.open(image_path)
-        img_w, img_h = img.size
-        
-        # Target dimensions for the video (portrait orientation)
-        target_width = 1080
-        target_height = 1920
-        
-        # Create the background image clip
-        image_clip = (mp.ImageClip(str(image_path))
-                      .set_duration(total_duration))
-        
-        # Calculate scaling to fit the image within the target dimensions
-        # while maintaining aspect ratio and adding black bars where needed
-        width_ratio = target_width / img_w
-        height_ratio = target_height / img_h
-        
-        # Use the smaller ratio to ensure the image fits completely
-        scale_factor = min(width_ratio, height_ratio)
-        
-        # Calculate new dimensions
-        new_width = int(img_w * scale_factor)
-        new_height = int(img_h * scale_factor)
-        
-        # Resize the image while maintaining aspect ratio
-        image_clip = image_clip.resize(width=new_width, height=new_height)
-        
-        # Apply grow and turn effect if requested
-        if use_grow_and_turn:
-            image_clip = apply_grow_and_turn_effect(image_clip, total_duration)
-        
-        # Center the image on the black background
-        image_clip = image_clip.set_position(('center', 'center'))
-        
-        # Create black background
-        bg_clip = mp.ColorClip(size=(target_width, target_height), color=(0, 0, 0))
-        bg_clip = bg_clip.set_duration(total_duration)
-        
-        # List to hold all clips
-        clips = [bg_clip, image_clip]
-        
-        # Add effects if available
-        if effect_paths:
-            for idx, effect_path in enumerate(effect_paths):
-                if effect_path.exists():
-                    try:
-                        print(f"Adding effect from: {effect_path}")
-                        
-                        # Load the effect
-                        effect_clip = mp.VideoFileClip(str(effect_path))
+        source_args = dict(image_path=str(image_path), total_duration=total_duration,
+                           effect_paths=[str(p) for p in effect_paths or []],
+                           use_grow_and_turn=use_grow_and_turn, animation=animation, grade=grade)
+        if preview:
+            print(f"Rendering a preview at {PREVIEW_WIDTH}x{PREVIEW_HEIGHT}, {PREVIEW_FPS} fps")
+            source_args.update(fps=PREVIEW_FPS, target_width=PREVIEW_WIDTH, target_height=PREVIEW_HEIGHT)
+            if encoder is None:
+                encoder = "preview"
+        if audio_reactive:
+            # One envelope for the whole narration, resampled to the video frame rate
+            options = dict(audio_reactive) if isinstance(audio_reactive, dict) else {}
+            drive = options.pop("drive", "rms")
+            envelope_fps = source_args.get("fps", DEFAULT_FPS)
+            with profiler.timed("audio_envelope"):
+                rms, onset = audio.envelope(envelope_fps, int(np.ceil(total_duration * envelope_fps)))
+            print(f"The image follows the narration ({drive})")
+            source_args["reactive"] = AudioReactive(rms if drive == "rms" else onset, envelope_fps, **options)
+        
+        output_path = Path(output_path)
+        encoder_settings = get_encoder_settings(encoder)
+        segment_cache = get_segment_cache(cache_segments)
+        # The main output at the render size, then any extra outputs, all fed by the same frames.
+        # Built before the source, so a bad output fails before anything is decoded or rendered
+        profiles = [OutputProfile(output_path, encoder=encoder_settings)]
+        profiles += [get_output_profile(output) for output in outputs or []]
+        if len(profiles) > 1:
+            print(f"Encoding {len(profiles)} outputs: " + ", ".join(str(p.path.name) for p in profiles))
+        
+        source = FrameSource(**source_args, profiler=profiler)
+        fps = source.fps
+        
+        # The animation timing still follows the full narration, only fewer frames are written
+        total_frames = source.total_frames
+        output_duration = None
+        if max_seconds is not None and max_seconds * fps < total_frames:
+            total_frames = max(1, int(np.ceil(max_seconds * fps)))
+            output_duration = total_frames / fps
+            print(f"Rendering only the first {output_duration:.2f} seconds")
+        
+        # Frames that need compositing: all of them with overlays, only the intro without
+        animated_frames = min(source.animated_frames, total_frames)
+        
+        if segments == "auto":
+            segments = choose_segment_count(animated_frames, fps)
+        if workers == "auto":
+            workers = choose_worker_count(animated_frames)
+        
+        # Frames for a single encode come from this process, or from a pool of worker processes
+        # that render frames concurrently and hand them back in order
+        frame_pool = None
+        produce_frames = source.frames
+        if segments <= 1 and workers > 1 and animated_frames > 1:
+            print(f"Producing frames in {workers} worker processes")
+            frame_pool = FramePool(FrameSource, source_args, source.width, source.height, workers, window)
+            produce_frames = frame_pool.frames
+        
+        try:
+            if segment_cache is None and segments <= 1 and not source.static_hold:
+                # Overlays change every frame, so every frame still goes through the compositor.
+                # Frames are piped straight into ffmpeg, which also muxes the audio from the source file
+                print(f"Writing video to {output_path}...")
+                write_frames(produce_frames(0, total_frames), profiles, source.width, source.height,
+                             fps, audio_path=audio_path, audio_codec=audio.codec,
+                             duration=output_duration, profiler=profiler)
+            else:
+                # The video is encoded as parts joined with the concat demuxer (stream copy) while
+                # muxing the audio. Without overlays the hold is a still-image loop encoded by ffmpeg
+                if segment_cache is not None:
+                    # The intro is a part of its own, so a render that only changes the narration
+                    # reuses it (and the hold too, if the length is the same)
+                    intro_end = min(source.intro_frames, total_frames)
+                    parts = [("intro", 0, intro_end, False), ("hold", intro_end, total_frames, source.static_hold)]
+                    signature = source.signature(segment_cache.cache_dir)
+                else:
+                    parts = [("frames", 0, animated_frames, False), ("hold", animated_frames, total_frames, True)]
+                parts = [part for part in parts if part[2] > part[1]]
+                if segments > 1:
+                    # Segments start on keyframes, so every segment is independently decodable
+                    encoder_settings.gop = encoder_settings.gop or fps
+                    for profile in profiles:
+                        profile.encoder.gop = encoder_settings.gop
+                
+                work_dir = Path(tempfile.mkdtemp(prefix="render_", dir=output_path.parent))
+                try:
+                    # Segment files of each output, in order
+                    segment_paths = [[] for _ in profiles]
+                    for name, start, end, static in parts:
+                        keys = None
+                        if segment_cache is not None:
+                            keys = [segment_cache.key(signature, name, start, end, profile) for profile in profiles]
+                            cached = [segment_cache.get(key, work_dir) for key in keys]
+                            if all(cached):
+                                print(f"Using the cached {name} segment ({end - start} frames)")
+                                for k, path in enumerate(cached):
+                                    segment_paths[k].append(path)
+                                continue
                         
-                        # Make it loop for the duration of our video if it's shorter
-                        if effect_clip.duration < total_duration:
-                            effect_clip = effect_clip.fx(mp.vfx.loop, duration=total_duration)
+                        # Files of this part for each output
+                        part_paths = [[] for _ in profiles]
+                        if static:
+                            print(f"Encoding {end - start} static hold frames...")
+                            with profiler.timed("hold_encode"):
+                                for k, profile in enumerate(profiles):
+                                    part_paths[k].append(encode_still_segment(
+                                        source.hold_frame, work_dir / f"{name}_{k}.mp4", end - start,
+                                        fps, profile.encoder, scale=profile.scale_filter()))
                         else:
-                            # Trim if it's longer than our video
-                            effect_clip = effect_clip.subclip(0, total_duration)
-                        
-                        # Scale to cover the entire frame
-                        effect_clip = effect_clip.resize(height=target_height)
-                        if effect_clip.w < target_width:
-                            effect_clip = effect_clip.resize(width=target_width)
-                        
-                        # Center the effect
-                        effect_clip = effect_clip.set_position(('center', 'center'))
-                        
-                        # Use a blending mode suitable for overlays
-                        # Set the same opacity for all effects
-                        effect_opacity = 0.2  # Fixed opacity value for all effects
-                        
-                        effect_clip = effect_clip.set_opacity(effect_opacity)
+                            if segments > 1:
+                                ranges = [(start + range_start, start + range_end) for range_start, range_end
+                                          in split_segments(end - start, segments, encoder_settings.gop)]
+                            else:
+                                ranges = [(start, end)]
+                            
+                            if len(ranges) > 1:
+                                changes = [segment_encoder_changes(profile.encoder, len(ranges)) for profile in profiles]
+                                print(f"Rendering {end - start} frames in {len(ranges)} parallel segments...")
+                                with profiler.timed("render_segments"), \
+                                        ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+                                    futures = [pool.submit(render_segment, source_args, range_start, range_end,
+                                                           [profile.with_path(work_dir / f"{name}_{i:03d}_{k}.mp4",
+                                                                              **changes[k])
+                                                            for k, profile in enumerate(profiles)])
+                                               for i, (range_start, range_end) in enumerate(ranges)]
+                                    for future in futures:
+                                        for k, path in enumerate(future.result()):
+                                            part_paths[k].append(path)
+                            else:
+                                print(f"Rendering {end - start} frames...")
+                                part_outputs = [profile.with_path(work_dir / f"{name}_{k}.mp4")
+                                                for k, profile in enumerate(profiles)]
+                                write_frames(produce_frames(start, end), part_outputs, source.width,
+                                             source.height, fps, profiler=profiler)
+                                for k, output in enumerate(part_outputs):
+                                    part_paths[k].append(output.path)
                         
-                        # Add the effect clip on top of the other clips
-                        clips.append(effect_clip)
-                        
-                        print(f"Effect '{effect_path.name}' added successfully with opacity {effect_opacity:.2f}")
-                    except Exception as e:
-                        print(f"Error adding effect {effect_path}: {e}. Skipping this effect.")
-                        traceback.print_exc()
-            
-        # Combine all clips
-        video = mp.CompositeVideoClip(clips, size=(target_width, target_height))
-        
-        # Add audio
-        audio_clip = mp.AudioFileClip(str(audio_path))
-        video = video.set_audio(audio_clip)
-        
-        # Write the video file
-        print(f"Writing video to {output_path}...")
-        video.write_videofile(
-            str(output_path),
-            fps=24,
-            codec='libx264',
-            audio_codec='aac',
-            bitrate='5000k',
-            audio_bitrate='192k',
-            threads=4
-        )
+                        if keys is not None:
+                            with profiler.timed("segment_cache"):
+                                # The render goes on with its own files, which no other render can evict
+                                for key, paths in zip(keys, part_paths):
+                                    segment_cache.put(key, paths)
+                        for k, paths in enumerate(part_paths):
+                            segment_paths[k].extend(paths)
+                
+                    with profiler.timed("concat_mux"):
+                        for profile, paths in zip(profiles, segment_paths):
+                            print(f"Writing video to {profile.path}...")
+                            concat_segments(paths, profile.path, audio_path, profile.encoder, audio.codec,
+                                            duration=output_duration, container=profile.container,
+                                            work_dir=work_dir)
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+        
+        finally:
+            if frame_pool is not None:
+                frame_pool.close()
+        
+        if thumbnail is not None:
+            with profiler.timed("thumbnail"):
+                save_thumbnail(source, thumbnail, thumbnail_time)
         
         # Properly close all clips to avoid FFMPEG errors
-        video.close()
-        audio_clip.close()
-        image_clip.close()
-        bg_clip.close()
+        source.close()
         
-        # Close any effect clips
-        if effect_paths:
-            for clip in clips[2:]:  # Skip bg_clip and image_clip which are already closed
-                try:
-                    clip.close()
-                except:
-                    pass
+        if profiler.enabled:
+            profiler.write(output_path)
         
         print(f"Video created successfully: {output_path}")
         return output_path
@@ -277,15 +605,76 @@ def create_video(image_path, audio_path, output_path, effect_paths=None, use_gro
         return None
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create a video from the image and speech of a run")
+    parser.add_argument("--run-id", default=None, help="Run to make the video of (default: the latest run)")
+    parser.add_argument("--encoder", choices=sorted(ENCODER_PRESETS), default=None,
+                        help="x264 encoder preset (default: medium preset at 5000k, ultrafast for previews)")
+    parser.add_argument("--segments", default="1",
+                        help="Render the video as N segments in parallel processes, or 'auto'")
+    parser.add_argument("--preview", action="store_true",
+                        help="Render a quick draft (540x960, 12 fps, ultrafast) as the run's preview.mp4")
+    parser.add_argument("--seconds", type=float, default=None,
+                        help="Only render the first N seconds")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write a JSON render profile next to the video")
+    parser.add_argument("--workers", default="1",
+                        help="Produce frames in N worker processes feeding one encoder, or 'auto'")
+    parser.add_argument("--window", type=int, default=None,
+                        help="Maximum frames in flight between the workers and the encoder")
+    parser.add_argument("--animation", choices=sorted(ANIMATION_PRESETS) + ["none"], default="grow_and_turn",
+                        help="Animation of the image (default: grow_and_turn)")
+    parser.add_argument("--exposure", type=float, default=0.0,
+                        help="Brightness correction in stops (e.g. 0.5 brightens, -0.5 darkens)")
+    parser.add_argument("--gamma", type=float, default=1.0,
+                        help="Gamma correction (above 1 lifts the midtones)")
+    parser.add_argument("--saturation", type=float, default=1.0,
+                        help="Saturation multiplier (0 is black and white)")
+    parser.add_argument("--lut", default=None,
+                        help="3D LUT file (.cube) applied after the other corrections")
+    parser.add_argument("--also", action="append", default=[], metavar="WxH[:PRESET[:EXT]]",
+                        help="Also encode a scaled copy from the same frames, e.g. 720x1280:quality "
+                             "(written as video_720x1280.mp4; repeat for more copies)")
+    parser.add_argument("--thumbnail", action="store_true",
+                        help="Save a poster thumbnail next to the video as video.jpg")
+    parser.add_argument("--audio-reactive", choices=["rms", "onset"], default=None,
+                        help="Make the image pulse with the narration's loudness (rms) or word onsets (onset)")
+    parser.add_argument("--pulse-scale", type=float, default=0.06,
+                        help="Scale-up of the image at full loudness with --audio-reactive (default: 0.06)")
+    parser.add_argument("--pulse-brightness", type=float, default=0.15,
+                        help="Brightness boost at full loudness with --audio-reactive (default: 0.15)")
+    parser.add_argument("--pulse-shake", type=float, default=0.0,
+                        help="Shake (fraction of the frame) at full loudness with --audio-reactive")
+    parser.add_argument("--no-segment-cache", action="store_true",
+                        help="Render every frame, without reusing or storing cached intro/hold segments")
+    parser.add_argument("--thumbnail-time", type=float, default=None,
+                        help="Time of the thumbnail in seconds (default: when the animation has settled)")
+    args = parser.parse_args()
+    if args.gamma <= 0:
+        parser.error(f"--gamma {args.gamma}: must be greater than 0")
+    also = []
+    for spec in args.also:
+        size, _, rest = spec.partition(":")
+        preset, _, extension = rest.partition(":")
+        match = re.fullmatch(r"(\d+)x(\d+)", size.lower())
+        if not match:
+            parser.error(f"--also {spec}: expected WxH[:PRESET[:EXT]], e.g. 720x1280:quality:mkv")
+        width, height = int(match[1]), int(match[2])
+        extension = extension or "mp4"
+        try:
+            # Checks the size, preset and container now instead of after the render
+            OutputProfile(f"{'preview' if args.preview else 'video'}_{width}x{height}.{extension}", width, height,
+                          encoder=preset or args.encoder)
+        except ValueError as e:
+            parser.error(f"--also {spec}: {e}")
+        also.append((width, height, preset, extension))
+    
     try:
-        # Make sure necessary directories exist
-        output_dir = Path(__file__).parent.parent / "results/videos"
-        output_dir.mkdir(parents=True, exist_ok=True)
+        run = get_run(args.run_id)
         
         print("\n" + "="*50)
-        print("STEP 1: FINDING LATEST GENERATED FILES")
+        print("STEP 1: FINDING THE RUN'S FILES")
         print("="*50)
-        speech_file, image_file = find_latest_files()
+        speech_file, image_file = find_run_files(run)
         
         if not speech_file or not image_file:
             print("Missing required files. Exiting.")
@@ -294,28 +683,38 @@ if __name__ == "__main__":
         print("\n" + "="*50)
         print("STEP 2: FINDING VIDEO EFFECTS")
         print("="*50)
-        effect_paths = find_effects()
-        
-        # If no effects found, check for fire effect as fallback
-        if not effect_paths:
-            print("No effects found. Checking for fire effect...")
-            fire_effect_path = download_fire_effect()
-            if fire_effect_path and fire_effect_path.exists():
-                effect_paths = [fire_effect_path]
-            
-        # Create output video path
-        video_files = list(output_dir.glob("video_*.mp4"))
-        next_number = len(video_files) + 1 if video_files else 1
-        output_path = output_dir / f"video_{next_number}.mp4"
-        
-        # Ask if grow and turn effect should be used
-        use_grow_and_turn = True  # Default to using the effect
+        effect_paths = get_effect_paths()
+        # Previews never replace the run's video, which is what gets uploaded
+        output_path = run.preview_path if args.preview else run.video_path
+        
+        # Extra outputs are named after the main one
+        outputs = [OutputProfile(output_path.with_name(f"{output_path.stem}_{width}x{height}.{extension}"),
+                                 width, height, encoder=preset or args.encoder)
+                   for width, height, preset, extension in also]
+        thumbnail_path = output_path.with_suffix(".jpg") if args.thumbnail else None
+        
+        # The grow and turn effect is the default animation
+        use_grow_and_turn = args.animation != "none"
+        animation = args.animation if use_grow_and_turn else None
         
         print("\n" + "="*50)
         print("STEP 3: CREATING VIDEO WITH EFFECTS")
         print("="*50)
-        print("Applying grow and turn effect to image: Yes")
-        video_path = create_video(image_file, speech_file, output_path, effect_paths, use_grow_and_turn)
+        print(f"Animation of the image: {args.animation}")
+        video_path = create_video(image_file, speech_file, output_path, effect_paths, use_grow_and_turn,
+                                  encoder=args.encoder,
+                                  segments=args.segments if args.segments == "auto" else int(args.segments),
+                                  preview=args.preview, max_seconds=args.seconds, profile=args.profile,
+                                  workers=args.workers if args.workers == "auto" else int(args.workers),
+                                  window=args.window, animation=animation,
+                                  grade=dict(exposure=args.exposure, gamma=args.gamma,
+                                             saturation=args.saturation, lut_path=args.lut),
+                                  outputs=outputs, thumbnail=thumbnail_path, thumbnail_time=args.thumbnail_time,
+                                  cache_segments=not args.no_segment_cache,
+                                  audio_reactive=args.audio_reactive and dict(drive=args.audio_reactive,
+                                                                              scale=args.pulse_scale,
+                                                                              brightness=args.pulse_brightness,
+                                                                              shake=args.pulse_shake))
         
         if not video_path:
             print("Failed to create video. Exiting.")
@@ -325,7 +724,11 @@ if __name__ == "__main__":
         print("VIDEO CREATION COMPLETE!")
         print("="*50)
         print(f"Video saved to: {video_path}")
-        print(f"Number of effects applied: {len(effect_paths)} overlay(s) + grow and turn effect")
+        for output in outputs:
+            print(f"Copy saved to: {output.path}")
+        if thumbnail_path:
+            print(f"Thumbnail saved to: {thumbnail_path}")
+        print(f"Number of effects applied: {len(effect_paths)} overlay(s) + {args.animation} animation")
         print("="*50 + "\n")
         
         # Ensure console output is fully displayed before exiting
@@ -0,0 +1,337 @@
+from pathlib import Path
+import re
+import copy
+import time
+import subprocess
+import tempfile
+from moviepy.config import get_setting
+from PIL import Image
+import numpy as np
+
+# Use the same ffmpeg binary moviepy was configured with
+FFMPEG_BINARY = get_setting("FFMPEG_BINARY")
+
+_DURATION_RE = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+def probe_media(path):
+    """ffmpeg's description of a media file's header (streams, codecs, metadata) and its duration
+    in seconds (None if the header has none), without decoding anything"""
+    # `ffmpeg -i` with no output only parses the headers (and exits with an error code)
+    result = subprocess.run([FFMPEG_BINARY, "-hide_banner", "-i", str(path)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    info = result.stderr.decode(errors="replace")
+    duration_match = _DURATION_RE.search(info)
+    if not duration_match:
+        return info, None
+    hours, minutes, seconds = duration_match.groups()
+    return info, int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+class EncoderSettings:
+    """x264/AAC settings for every ffmpeg call of a render.
+
+    Segments that are joined with a stream copy must all be encoded with the same settings.
+    Use either a fixed bitrate or a CRF (constant quality) value. With a fixed bitrate, maxrate and
+    bufsize cap the rate over any window of bufsize bits (x264 VBV).
+    """
+
+    def __init__(self, preset="medium", crf=None, bitrate="5000k", tune=None, threads=4,
+                 pix_fmt="yuv420p", audio_codec="aac", audio_bitrate="192k", gop=None,
+                 maxrate=None, bufsize=None):
+        self.preset = preset
+        self.crf = crf
+        self.bitrate = bitrate if crf is None else None
+        self.tune = tune
+        self.threads = threads
+        self.pix_fmt = pix_fmt
+        self.audio_codec = audio_codec
+        self.audio_bitrate = audio_bitrate
+        # Fixed keyframe interval in frames (None lets x264 decide)
+        self.gop = gop
+        self.maxrate = maxrate
+        self.bufsize = bufsize
+
+    def video_args(self):
+        args = ["-c:v", "libx264", "-preset", self.preset]
+        if self.crf is not None:
+            args += ["-crf", self.crf]
+        elif self.bitrate:
+            args += ["-b:v", self.bitrate]
+            if self.maxrate:
+                args += ["-maxrate", self.maxrate, "-bufsize", self.bufsize or self.maxrate]
+        if self.tune:
+            args += ["-tune", self.tune]
+        if self.threads:
+            args += ["-threads", self.threads]
+        if self.gop:
+            args += ["-g", self.gop, "-keyint_min", self.gop, "-sc_threshold", 0]
+        return args + ["-pix_fmt", self.pix_fmt]
+
+    def audio_args(self, source_codec=None):
+        """Audio encoding arguments; the source is stream-copied when it already has the target codec"""
+        if self.audio_codec == "copy" or (source_codec is not None and source_codec == self.audio_codec):
+            return ["-c:a", "copy"]
+        return ["-c:a", self.audio_codec, "-b:a", self.audio_bitrate]
+
+# Named encoder presets. "default" matches the settings used before the pipe writer existed.
+ENCODER_PRESETS = {
+    "default": dict(preset="medium", bitrate="5000k", threads=4),
+    "fast": dict(preset="veryfast", crf=21, threads=0),
+    "quality": dict(preset="slow", crf=18, tune="film", threads=0),
+    "preview": dict(preset="ultrafast", crf=28, threads=0, audio_bitrate="96k"),
+}
+
+def get_encoder_settings(encoder=None):
+    """Accept EncoderSettings, a preset name, a dict of EncoderSettings arguments or None (default)"""
+    if isinstance(encoder, EncoderSettings):
+        # Renders adjust threads/gop on their settings, so never hand back the caller's object
+        return copy.copy(encoder)
+    if encoder is None:
+        encoder = "default"
+    if isinstance(encoder, str):
+        if encoder not in ENCODER_PRESETS:
+            raise ValueError(f"Unknown encoder preset '{encoder}'. Available: {', '.join(ENCODER_PRESETS)}")
+        encoder = ENCODER_PRESETS[encoder]
+    return EncoderSettings(**encoder)
+
+# Containers (file extensions and ffmpeg format names) that hold H.264 video with AAC or MP3 audio
+H264_CONTAINERS = {"mp4", "mov", "mkv", "matroska", "ts", "mpegts", "flv", "avi"}
+
+class OutputProfile:
+    """One encoded output of a render: where it goes, its size, encoder settings and container.
+
+    width/height of None keep the render size; giving only one of them keeps the aspect ratio.
+    The container is taken from the file extension unless given (an ffmpeg format name). It must
+    be able to hold the encoder's H.264 video, which is checked here rather than by ffmpeg after
+    the whole render.
+    """
+
+    def __init__(self, path, width=None, height=None, encoder=None, container=None):
+        self.path = Path(path)
+        self.width = width
+        self.height = height
+        self.encoder = get_encoder_settings(encoder)
+        self.container = container
+        for size in (width, height):
+            if size is not None and (size <= 0 or size % 2):
+                raise ValueError(f"{self.path.name}: sizes must be positive and even (yuv420p), got {width}x{height}")
+        format_name = (container or self.path.suffix.lstrip(".")).lower()
+        if format_name not in H264_CONTAINERS:
+            raise ValueError(f"{self.path.name}: '{format_name}' can't hold H.264/{self.encoder.audio_codec} "
+                             f"(use one of: {', '.join(sorted(H264_CONTAINERS))})")
+
+    def scale_filter(self):
+        if self.width is None and self.height is None:
+            return None
+        # -2 keeps the aspect ratio with an even size, which yuv420p needs
+        return f"scale={self.width or -2}:{self.height or -2}"
+
+    def output_args(self, fps):
+        """Video encoding and container arguments for this output"""
+        args = self.encoder.video_args() + ["-r", fps]
+        container = self.container or self.path.suffix.lstrip(".").lower()
+        if container in ("mp4", "mov"):
+            # Index at the front, so the file can be played while it downloads
+            args += ["-movflags", "+faststart"]
+        if self.container:
+            args += ["-f", self.container]
+        return args
+
+    def with_path(self, path, **encoder_changes):
+        """Same size and settings, written to another path (e.g. a segment of this output), with
+        encoder_changes applied to a copy of the encoder settings"""
+        profile = OutputProfile(path, self.width, self.height, self.encoder, None)
+        for name, value in encoder_changes.items():
+            setattr(profile.encoder, name, value)
+        return profile
+
+def get_output_profile(output):
+    """Accept an OutputProfile or a dict of OutputProfile arguments"""
+    if isinstance(output, OutputProfile):
+        # Renders adjust the encoder settings of their profiles, so never hand back the caller's object
+        return OutputProfile(output.path, output.width, output.height, output.encoder, output.container)
+    return OutputProfile(**output)
+
+def _as_profiles(output, settings):
+    """A list of OutputProfile for a single output path (with settings) or a list of profiles"""
+    if isinstance(output, (list, tuple)):
+        return [get_output_profile(o) for o in output]
+    return [OutputProfile(output, encoder=settings)]
+
+def _split_outputs(profiles):
+    """-filter_complex arguments feeding every output from input 0, and the stream to map per output.
+    
+    The frames are split once and each scaled copy is made once, inside the one ffmpeg process.
+    """
+    scales = [profile.scale_filter() for profile in profiles]
+    if len(profiles) == 1 and scales[0] is None:
+        return [], ["0:v:0"]
+    split = f"[0:v]split={len(profiles)}" + "".join(f"[s{i}]" for i in range(len(profiles)))
+    graph, labels = [split], []
+    for i, scale in enumerate(scales):
+        if scale is None:
+            labels.append(f"[s{i}]")
+        else:
+            graph.append(f"[s{i}]{scale}[o{i}]")
+            labels.append(f"[o{i}]")
+    return ["-filter_complex", ";".join(graph)], labels
+
+def run_ffmpeg(args):
+    """Run ffmpeg with the given arguments, raising RuntimeError if it fails"""
+    cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error"] + [str(a) for a in args]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {' '.join(cmd)}\n{result.stderr.decode(errors='replace')}")
+
+class FFmpegPipeWriter:
+    """Streams raw RGB frames into an ffmpeg subprocess, optionally muxing audio in the same call.
+
+    output_path is a path (encoded with settings) or a list of OutputProfile: every profile is
+    encoded by the same ffmpeg process from the one stream of frames.
+    """
+
+    def __init__(self, output_path, width, height, fps, settings=None, audio_path=None, audio_codec=None,
+                 duration=None):
+        self.outputs = _as_profiles(output_path, settings)
+        self.width = width
+        self.height = height
+        self.frames_written = 0
+
+        cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", fps, "-i", "-"]
+        if audio_path is not None:
+            # Audio is read straight from the source file, no temporary audio file
+            cmd += ["-i", audio_path]
+        filter_args, video_streams = _split_outputs(self.outputs)
+        cmd += filter_args
+        for profile, video_stream in zip(self.outputs, video_streams):
+            cmd += ["-map", video_stream]
+            if audio_path is not None:
+                cmd += ["-map", "1:a:0"] + profile.encoder.audio_args(audio_codec)
+            else:
+                cmd += ["-an"]
+            if duration is not None:
+                # Cut the (longer) audio to the rendered frames
+                cmd += ["-t", f"{duration:.3f}"]
+            cmd += profile.output_args(fps) + [profile.path]
+
+        # ffmpeg's stderr goes to a file so a chatty encoder can never block the pipe
+        self._log = tempfile.TemporaryFile()
+        self._cmd = [str(a) for a in cmd]
+        self._process = subprocess.Popen(self._cmd, stdin=subprocess.PIPE,
+                                         stdout=subprocess.DEVNULL, stderr=self._log)
+
+    def write_frame(self, frame):
+        if frame.shape != (self.height, self.width, 3):
+            raise ValueError(f"Frame shape {frame.shape} does not match {self.width}x{self.height}")
+        try:
+            self._process.stdin.write(memoryview(np.ascontiguousarray(frame)))
+        except BrokenPipeError:
+            self._process.wait()
+            raise RuntimeError(f"ffmpeg stopped accepting frames:\n{self._read_log()}")
+        self.frames_written += 1
+
+    def close(self):
+        """Finish the encode and raise RuntimeError if ffmpeg failed"""
+        if self._log.closed:
+            return
+        if self._process.stdin and not self._process.stdin.closed:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+        returncode = self._process.wait()
+        log = self._read_log()
+        self._log.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {' '.join(self._cmd)}\n{log}")
+
+    def abort(self):
+        """Stop the encode without waiting for it to finish (used on errors)"""
+        if self._log.closed:
+            return
+        self._process.kill()
+        self._process.wait()
+        self._log.close()
+
+    def _read_log(self):
+        self._log.seek(0)
+        return self._log.read().decode(errors="replace")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+def write_frames(frames, output_path, width, height, fps, settings=None, audio_path=None, audio_codec=None,
+                 duration=None, profiler=None):
+    """Encode an iterable of RGB frames (and optionally the audio) into output_path
+    
+    With a profiler, the time spent producing each frame and the time spent handing it to
+    ffmpeg (which blocks while the encoder is busy) are recorded separately.
+    """
+    writer = FFmpegPipeWriter(output_path, width, height, fps, settings, audio_path, audio_codec, duration)
+    with writer:
+        if profiler is None or not profiler.enabled:
+            for frame in frames:
+                writer.write_frame(frame)
+        else:
+            frames = iter(frames)
+            while True:
+                start = time.perf_counter()
+                frame = next(frames, None)
+                generated = time.perf_counter()
+                if frame is None:
+                    break
+                writer.write_frame(frame)
+                profiler.add_frame(generated - start, time.perf_counter() - generated)
+            # Closing the pipe waits for the encoder to flush its remaining frames
+            flush_start = time.perf_counter()
+            writer.close()
+            profiler.encoder_seconds += time.perf_counter() - flush_start
+    return writer.frames_written
+
+def encode_still_segment(frame, output_path, n_frames, fps, settings=None, scale=None):
+    """Encode a single RGB frame held for n_frames as a video segment (ffmpeg still-image loop)"""
+    settings = get_encoder_settings(settings)
+    still_path = output_path.with_suffix(".png")
+    Image.fromarray(frame).save(still_path)
+    scale_args = ["-vf", scale] if scale else []
+    run_ffmpeg(["-loop", "1", "-framerate", fps, "-i", still_path,
+                "-frames:v", n_frames, "-r", fps] + scale_args + settings.video_args() + ["-an", output_path])
+    still_path.unlink()
+    return output_path
+
+def concat_segments(segment_paths, output_path, audio_path=None, settings=None, audio_codec=None,
+                    duration=None, container=None, work_dir=None):
+    """Join encoded segments with the concat demuxer (stream copy) and mux in the audio.
+    The concat list is a temporary file in work_dir (default: next to the output)."""
+    settings = get_encoder_settings(settings)
+    # A unique name, so renders to the same output (or the same stem) never share a list
+    fd, list_path = tempfile.mkstemp(prefix=f"{output_path.stem}_", suffix="_segments.txt",
+                                     dir=work_dir or output_path.parent)
+    list_path = Path(list_path)
+    with open(fd, "w", encoding="utf-8") as f:
+        for segment_path in segment_paths:
+            escaped = str(segment_path.resolve()).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    args = ["-f", "concat", "-safe", "0", "-i", list_path]
+    if audio_path is not None:
+        args += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0"] + settings.audio_args(audio_codec)
+    if duration is not None:
+        args += ["-t", f"{duration:.3f}"]
+    args += ["-c:v", "copy"]
+    if (container or output_path.suffix.lstrip(".").lower()) in ("mp4", "mov"):
+        args += ["-movflags", "+faststart"]
+    if container:
+        args += ["-f", container]
+    args += [output_path]
+    try:
+        run_ffmpeg(args)
+    finally:
+        list_path.unlink()
+    return output_path
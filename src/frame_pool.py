@@ -0,0 +1,93 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+# Per-process state of a pool worker, set up once by _init_worker
+_worker = {}
+
+def _init_worker(source_factory, source_args, shm_name, shape):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker["shm"] = shm
+    _worker["slots"] = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    _worker["source"] = source_factory(**source_args)
+
+def _render_frame(index, slot):
+    _worker["slots"][slot] = _worker["source"].frame(index)
+    return index
+
+def choose_worker_count(n_frames, cpu_count=None):
+    """One frame producer per core, keeping a core for ffmpeg when there are enough of them"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, min(cpu_count - 1 if cpu_count > 2 else cpu_count, n_frames))
+
+class FramePool:
+    """Produces frames in worker processes and hands them back in frame order.
+
+    Every worker builds its own frame source with source_factory(**source_args) (anything with a
+    frame(index) method returning an RGB frame) and writes finished frames into a ring of `window`
+    shared-memory slots. At most `window` frames are in flight, so memory use does not grow with the
+    video length, and frames reach the encoder strictly in sequence.
+    """
+
+    def __init__(self, source_factory, source_args, width, height, workers, window=None):
+        self.workers = max(1, workers)
+        self.window = max(self.workers, window or 2 * self.workers)
+        self.width = width
+        self.height = height
+        shape = (self.window, height, width, 3)
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+        self._slots = np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf)
+        try:
+            # Workers are spawned, not forked: a forked worker would inherit the encoder's stdin
+            # pipe and ffmpeg would never see the end of the input
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker,
+                                             initargs=(source_factory, source_args, self._shm.name, shape))
+        except Exception:
+            self._release_memory()
+            raise
+
+    def frames(self, start, end):
+        """Yield frames start..end-1 in order (each yielded array is reused once the next one is requested)"""
+        pending = deque()
+        free_slots = deque(range(self.window))
+        next_index = start
+        try:
+            while next_index < end or pending:
+                # Keep the window full: a slot is only reused after its frame has been consumed
+                while next_index < end and free_slots:
+                    slot = free_slots.popleft()
+                    pending.append((self._pool.submit(_render_frame, next_index, slot), slot))
+                    next_index += 1
+                future, slot = pending.popleft()
+                future.result()
+                yield self._slots[slot]
+                free_slots.append(slot)
+        finally:
+            for future, _ in pending:
+                future.cancel()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        self._release_memory()
+
+    def _release_memory(self):
+        if self._shm is not None:
+            # Drop our view first, the block can't be closed while an array still points into it
+            self._slots = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
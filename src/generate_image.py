@@ -1,21 +1,21 @@
-from pathlib import Path
-from openai import OpenAI
 import sys
 import time
+import argparse
 import traceback
 import base64
+from image_cache import prepare_image
+from generate_text import get_openai_client
+from runs import get_run
 
-def read_first_line(file_path="../results/transcripts/first_line_transcript.txt"):
+def read_first_line(run):
     print("Reading first line from transcript...")
     try:
-        file_path = Path(__file__).parent / file_path
-        
-        if not file_path.exists():
-            print(f"Error: File not found at {file_path}")
+        if not run.transcript_path.exists():
+            print(f"Error: File not found at {run.transcript_path}")
             return None
             
-        with open(file_path, "r", encoding="utf-8") as f:
-            first_line = f.read().strip()
+        with open(run.transcript_path, "r", encoding="utf-8") as f:
+            first_line = character_name(f.read())
             
         print(f"Retrieved first line: {first_line}")
         return first_line
@@ -24,10 +24,15 @@ def read_first_line(file_path="../results/transcripts/first_line_transcript.txt"
         traceback.print_exc()
         return None
 
+def character_name(transcript):
+    """The first line of a transcript (the words the character is made of)"""
+    lines = transcript.split('\n')
+    return lines[0].strip() if lines else ""
+
 def generate_image(text):
     print(f"Generating image from gpt-image-1 for: {text}...")
     try:
-        client = OpenAI()
+        client = get_openai_client()
         
         # Split the hybrid name into its components
         # Assuming format like "Airplane Cat" (where Airplane is object, Cat is animal)
@@ -62,19 +67,10 @@ def generate_image(text):
         traceback.print_exc()
         return None
 
-def save_image(image_base64, output_dir="../results/images"):
+def save_image(image_base64, run):
     print("Saving image...")
     try:
-        # Create the images directory if it doesn't exist
-        output_dir_path = Path(__file__).parent / output_dir
-        output_dir_path.mkdir(parents=True, exist_ok=True)
-        
-        # Find the next available file name
-        existing_files = list(output_dir_path.glob("image_*.png"))
-        next_number = len(existing_files) + 1 if existing_files else 1
-        
-        # Create the new image file path
-        image_file_path = output_dir_path / f"image_{next_number}.png"
+        image_file_path = run.image_path
         
         # Decode base64 and save the image
         image_bytes = base64.b64decode(image_base64)
@@ -82,6 +78,13 @@ def save_image(image_base64, output_dir="../results/images"):
             f.write(image_bytes)
                 
         print(f"Image saved to: {image_file_path}")
+        
+        # Prepare the render-ready copy now, so the video step doesn't decode and resize the PNG
+        try:
+            prepare_image(image_file_path)
+        except Exception as e:
+            print(f"Could not prepare the image for rendering (the video step will retry): {e}")
+        
         return image_file_path
     except Exception as e:
         print(f"Error saving image: {e}")
@@ -89,11 +92,18 @@ def save_image(image_base64, output_dir="../results/images"):
         return None
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the image of a run's character")
+    parser.add_argument("--run-id", default=None, help="Run to generate the image for (default: the latest run)")
+    args = parser.parse_args()
+    
     try:
+        run = get_run(args.run_id)
+        print(f"Run: {run.run_id}")
+        
         print("\n" + "="*50)
         print("STEP 1: READING FIRST LINE FROM TRANSCRIPT")
         print("="*50)
-        first_line = read_first_line()
+        first_line = read_first_line(run)
         
         if first_line is None:
             print("Failed to read first line. Exiting.")
@@ -111,7 +121,7 @@ if __name__ == "__main__":
         print("\n" + "="*50)
         print("STEP 3: SAVING IMAGE")
         print("="*50)
-        image_file = save_image(image_base64)
+        image_file = save_image(image_base64, run)
         
         if image_file is None:
             print("Failed to save image. Exiting.")
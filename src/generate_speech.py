@@ -1,54 +1,67 @@
-from pathlib import Path
 import requests
 import json
 import sys
 import time
+import argparse
 import traceback
 import os
+import threading
+from runs import get_run
 
-def read_transcript(output_dir="../results/transcripts"):
+# Sessions are kept open between requests (connection reuse) when speeches are generated one
+# after another. requests.Session is not thread-safe, so every thread (a --count or daemon worker)
+# gets its own.
+_sessions = threading.local()
+
+def get_session():
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    return session
+
+def read_transcript(run):
     print("Reading transcript file...")
     try:
-        # Find the latest transcript file
-        output_dir_path = Path(__file__).parent / output_dir
-        transcript_files = list(output_dir_path.glob("transcript_*.txt"))
-        
-        if not transcript_files:
-            print("No transcript files found.")
+        if not run.transcript_path.exists():
+            print(f"No transcript found at {run.transcript_path}")
             return None
-            
-        latest_transcript = max(transcript_files, key=lambda x: int(x.stem.split('_')[1]))
-        print(f"Found latest transcript: {latest_transcript}")
         
         # Read the transcript file
-        with open(latest_transcript, "r", encoding="utf-8") as f:
-            lines = f.read().splitlines()
-        
-        # Skip the first two lines (hybrid name and Italian translation)
-        # And get the rest of the content (the Italian story)
-        italian_story_lines = []
-        skip_lines = 1
-        line_count = 0
-        
-        for line in lines:
-            if line_count >= skip_lines:
-                # Only add non-empty lines to avoid TTS pauses
-                if line.strip():
-                    italian_story_lines.append(line.strip())
-            if line.strip(): # Only count non-empty lines
-                line_count += 1
-        
-        # Join sentences with spaces instead of newlines to avoid TTS pauses
-        italian_story = ' '.join(italian_story_lines)
-        print(f"Extracted Italian story text ({len(italian_story_lines)} lines)")
-        
-        return italian_story
+        with open(run.transcript_path, "r", encoding="utf-8") as f:
+            transcript = f.read()
+        
+        return story_text(transcript)
     except Exception as e:
         print(f"Error reading transcript: {e}")
         traceback.print_exc()
         return None
 
-def text_to_speech(text, output_dir="../results/speeches", voice_id="pNInz6obpgDQGcFmaJgB"):
+def story_text(transcript):
+    """The story to narrate: the transcript without its first line, as one line of text"""
+    lines = transcript.splitlines()
+    
+    # Skip the first two lines (hybrid name and Italian translation)
+    # And get the rest of the content (the Italian story)
+    italian_story_lines = []
+    skip_lines = 1
+    line_count = 0
+    
+    for line in lines:
+        if line_count >= skip_lines:
+            # Only add non-empty lines to avoid TTS pauses
+            if line.strip():
+                italian_story_lines.append(line.strip())
+        if line.strip(): # Only count non-empty lines
+            line_count += 1
+    
+    # Join sentences with spaces instead of newlines to avoid TTS pauses
+    italian_story = ' '.join(italian_story_lines)
+    print(f"Extracted Italian story text ({len(italian_story_lines)} lines)")
+    
+    return italian_story
+
+def text_to_speech(text, speech_file_path, voice_id="pNInz6obpgDQGcFmaJgB"):
+    """Narrate text and save it to speech_file_path"""
     print("Converting text to speech using ElevenLabs...")
     try:
         # Get ElevenLabs API key from environment variable
@@ -60,14 +73,6 @@ def text_to_speech(text, output_dir="../results/speeches", voice_id="pNInz6obpgD
             print("On Unix/Mac: export ELEVENLABS_API_KEY=your_api_key_here")
             return None
         
-        output_dir_path = Path(__file__).parent / output_dir
-        output_dir_path.mkdir(parents=True, exist_ok=True)  # Ensure the directory exists
-
-        # Find the next available file name
-        existing_files = list(output_dir_path.glob("speech_*.mp3"))
-        next_number = len(existing_files) + 1 if existing_files else 1
-        speech_file_path = output_dir_path / f"speech_{next_number}.mp3"
-
         # ElevenLabs API endpoint
         url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
         
@@ -92,7 +97,7 @@ def text_to_speech(text, output_dir="../results/speeches", voice_id="pNInz6obpgD
         }
         
         print("Sending request to ElevenLabs API...")
-        response = requests.post(url, json=payload, headers=headers)
+        response = get_session().post(url, json=payload, headers=headers)
         
         if response.status_code == 200:
             # Save the audio file
@@ -142,11 +147,18 @@ def list_available_voices():
         print(f"Error listing voices: {e}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Narrate the story of a run")
+    parser.add_argument("--run-id", default=None, help="Run to narrate (default: the latest run)")
+    args = parser.parse_args()
+    
     try:
+        run = get_run(args.run_id)
+        print(f"Run: {run.run_id}")
+        
         print("\n" + "="*50)
         print("STEP 1: READING TRANSCRIPT")
         print("="*50)
-        italian_text = read_transcript()
+        italian_text = read_transcript(run)
         
         if italian_text is None:
             print("Failed to read transcript. Exiting.")
@@ -155,7 +167,7 @@ if __name__ == "__main__":
         print("\n" + "="*50)
         print("STEP 2: CONVERTING TO SPEECH")
         print("="*50)
-        speech_file = text_to_speech(italian_text)
+        speech_file = text_to_speech(italian_text, run.speech_path)
         
         if speech_file is None:
             print("Failed to convert text to speech. Exiting.")
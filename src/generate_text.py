@@ -1,14 +1,24 @@
-from pathlib import Path
 from openai import OpenAI
 import sys
 import time
+import argparse
 import traceback
 import random
+from runs import allocate_run, get_run
+
+# One client for every request of the process, so a long-running worker reuses its connections
+_client = None
+
+def get_openai_client():
+    global _client
+    if _client is None:
+        _client = OpenAI()
+    return _client
 
 def generate_response():
     print("Generating story from GPT-4o...")
     try:
-        client = OpenAI()
+        client = get_openai_client()
         
         # Define some potential objects and animals for the prompts
         objects = [
@@ -114,40 +124,29 @@ Follow these instructions exactly:
         traceback.print_exc()
         return None
 
-def save_text(text, output_dir="../results/transcripts"):
-    print("Saving transcript files...")
+def save_text(text, run):
+    """Save the transcript in the run's directory and return its path"""
+    print("Saving transcript...")
     try:
-        # Create the transcripts directory if it doesn't exist
-        output_dir_path = Path(__file__).parent / output_dir
-        output_dir_path.mkdir(parents=True, exist_ok=True)
-
-        # Find the next available file name
-        existing_files = list(output_dir_path.glob("transcript_*.txt"))
-        next_number = len(existing_files) + 1 if existing_files else 1
-
-        # Create the new transcript file path
-        transcript_file_path = output_dir_path / f"transcript_{next_number}.txt"
-
-        # Save the complete text to the transcript file
-        with open(transcript_file_path, "w", encoding="utf-8") as f:
+        with open(run.transcript_path, "w", encoding="utf-8") as f:
             f.write(text)
         
-        # Extract and save the first line to a separate file
-        lines = text.split('\n')
-        first_line = lines[0] if lines else ""
-        
-        first_line_path = output_dir_path / "first_line_transcript.txt"
-        with open(first_line_path, "w", encoding="utf-8") as f:
-            f.write(first_line)
-        
-        return transcript_file_path
+        return run.transcript_path
     except Exception as e:
         print(f"Error saving transcript: {e}")
         traceback.print_exc()
         return None
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the story of a new run")
+    parser.add_argument("--run-id", default=None,
+                        help="Save the transcript in this (existing) run instead of starting a new one")
+    args = parser.parse_args()
+    
     try:
+        run = get_run(args.run_id) if args.run_id else allocate_run()
+        print(f"Run: {run.run_id}")
+        
         print("\n" + "="*50)
         print("STEP 1: GENERATING STORY TEXT")
         print("="*50)
@@ -160,7 +159,7 @@ if __name__ == "__main__":
         print("\n" + "="*50)
         print("STEP 2: SAVING TRANSCRIPTS")
         print("="*50)
-        transcript_file = save_text(response_text)
+        transcript_file = save_text(response_text, run)
         
         if transcript_file is None:
             print("Failed to save transcript. Exiting.")
@@ -170,7 +169,7 @@ if __name__ == "__main__":
         print("TEXT GENERATION COMPLETE!")
         print("="*50)
         print(f"Transcript saved to: {transcript_file}")
-        print(f"First line saved to: first_line_transcript.txt")
+        print(f"Run ID: {run.run_id}")
         print("="*50 + "\n")
         
         # Ensure console output is fully displayed before exiting
@@ -0,0 +1,45 @@
+from pathlib import Path
+import os
+import time
+import numpy as np
+from PIL import Image
+from cache_tools import evict, file_hash, publish, touch, write_json, writer_id
+
+# Render-ready images live next to the decoded overlays (IMAGE_CACHE_DIR overrides it)
+IMAGE_CACHE_DIR = Path(os.getenv("IMAGE_CACHE_DIR", Path(__file__).parent.parent / "cache/images"))
+DEFAULT_MAX_BYTES = int(float(os.getenv("IMAGE_CACHE_MAX_GB", "1")) * 1024 ** 3)
+
+def fitted_size(image_size, width, height):
+    """Size of an image scaled to fit inside width x height, keeping its aspect ratio"""
+    img_w, img_h = image_size
+    # Use the smaller ratio to ensure the image fits completely
+    scale_factor = min(width / img_w, height / img_h)
+    return int(img_w * scale_factor), int(img_h * scale_factor)
+
+def prepare_image(image_path, width=1080, height=1920, cache_dir=IMAGE_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """Return the image decoded to RGBA and scaled to fit width x height, as a memory-mapped array.
+
+    The derivative is built on the first use (or by generate_image.save_image right after the
+    image is generated) and cached keyed by the file's content and the target size, so renders
+    and retries never decode or resample the full-resolution PNG again.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    image_path = Path(image_path).resolve()
+    key = f"{file_hash(image_path, cache_dir)[:32]}_{width}x{height}"
+    pixels_path = cache_dir / f"{key}.npy"
+    meta_path = cache_dir / f"{key}.json"
+
+    if not (pixels_path.exists() and meta_path.exists()):
+        print(f"Preparing {image_path.name} for rendering at {width}x{height}...")
+        with Image.open(image_path) as img:
+            size = fitted_size(img.size, width, height)
+            image = img.convert("RGBA").resize(size, Image.LANCZOS)
+        tmp_path = pixels_path.with_name(f"{pixels_path.stem}.{writer_id()}.tmp.npy")
+        np.save(tmp_path, np.asarray(image))
+        publish(tmp_path, pixels_path)
+        write_json(meta_path, {"source": str(image_path), "width": width, "height": height,
+                               "size": list(size), "created": time.time()})
+        evict(cache_dir, "*.npy", max_bytes, keep={key}, label="image")
+
+    touch(meta_path)
+    return np.load(pixels_path, mmap_mode="r")
@@ -0,0 +1,177 @@
+from pathlib import Path
+import os
+import json
+import time
+import sqlite3
+import contextlib
+
+# The queue lives next to the results it produces (JOB_QUEUE_DB overrides it)
+JOB_QUEUE_DB = Path(os.getenv("JOB_QUEUE_DB", Path(__file__).parent.parent / "results/jobs.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    context TEXT NOT NULL DEFAULT '{}',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    worker TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority DESC, id);
+"""
+
+class Job:
+    """A job claimed from the queue"""
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.priority = row["priority"]
+        self.attempts = row["attempts"]
+        self.max_attempts = row["max_attempts"]
+        # What the pipeline knows about the job: its completed stages and their outputs
+        self.context = json.loads(row["context"])
+
+class JobQueue:
+    """Durable job queue in a SQLite database, shared by any number of worker processes.
+
+    A job is queued -> running -> done | failed. Higher priorities are claimed first, then the
+    oldest job. A claimed job is leased to its worker for visibility_timeout seconds; the worker
+    extends the lease while it works (heartbeat), so a job whose worker crashed becomes visible
+    again when its lease runs out. A failed attempt is retried after an exponential backoff
+    until max_attempts.
+    """
+
+    def __init__(self, path=JOB_QUEUE_DB, visibility_timeout=600, backoff=30, max_backoff=3600):
+        self.path = Path(path)
+        self.visibility_timeout = visibility_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        # One short-lived connection per operation, so threads and processes never share one.
+        # isolation_level=None leaves the transactions to the BEGIN IMMEDIATE statements below.
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        # WAL lets the stats and enqueue calls read and write while workers claim jobs
+        db.execute("PRAGMA journal_mode=WAL")
+        # (sqlite3's own context manager only ends the transaction, this closes the connection)
+        return contextlib.closing(db)
+
+    def enqueue(self, context=None, priority=0, max_attempts=3):
+        """Add a job and return its id"""
+        now = time.time()
+        with self._connect() as db:
+            cursor = db.execute("INSERT INTO jobs (priority, context, max_attempts, available_at, created_at) "
+                                "VALUES (?, ?, ?, ?, ?)",
+                                (priority, json.dumps(context or {}, default=str), max_attempts, now, now))
+            return cursor.lastrowid
+
+    def claim(self, worker):
+        """Lease the next job to worker and return it, or None if no job is ready"""
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose worker disappeared on their last attempt have nothing left to retry
+                db.execute("UPDATE jobs SET status = 'failed', finished_at = ?, lease_until = NULL, "
+                           "error = 'Worker stopped responding (visibility timeout)' "
+                           "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                           (now, now))
+                row = db.execute("SELECT * FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+                                 "OR (status = 'running' AND lease_until < ?) "
+                                 "ORDER BY priority DESC, id LIMIT 1", (now, now)).fetchone()
+                if row is None:
+                    db.execute("COMMIT")
+                    return None
+                db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, "
+                           "lease_until = ?, started_at = ? WHERE id = ?",
+                           (worker, now + self.visibility_timeout, now, row["id"]))
+                row = db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return Job(row)
+
+    def heartbeat(self, job, worker):
+        """Extend the lease of a running job; False if the job is no longer leased to this worker"""
+        with self._connect() as db:
+            cursor = db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                                (time.time() + self.visibility_timeout, job.id, worker))
+            return cursor.rowcount == 1
+
+    def save(self, job, worker):
+        """Store the job's context (progress that a retry can pick up from)"""
+        # A copy, as the stages still running may add to the context while it is serialized
+        context = json.dumps(dict(job.context), default=str)
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET context = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                       (context, job.id, worker))
+
+    def complete(self, job, worker):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'done', context = ?, finished_at = ?, lease_until = NULL, "
+                       "error = NULL WHERE id = ? AND worker = ?",
+                       (json.dumps(job.context, default=str), time.time(), job.id, worker))
+
+    def fail(self, job, worker, error):
+        """Record a failed attempt: the job is retried after a backoff, or fails for good after
+        max_attempts. Returns the delay before the retry, or None if the job failed."""
+        now = time.time()
+        context = json.dumps(job.context, default=str)
+        with self._connect() as db:
+            if job.attempts >= job.max_attempts:
+                db.execute("UPDATE jobs SET status = 'failed', context = ?, error = ?, finished_at = ?, "
+                           "lease_until = NULL WHERE id = ? AND worker = ?",
+                           (context, error, now, job.id, worker))
+                return None
+            delay = min(self.max_backoff, self.backoff * 2 ** (job.attempts - 1))
+            db.execute("UPDATE jobs SET status = 'queued', context = ?, error = ?, available_at = ?, "
+                       "lease_until = NULL, worker = NULL WHERE id = ? AND worker = ?",
+                       (context, error, now + delay, job.id, worker))
+            return delay
+
+    def stats(self, window=900):
+        """Job counts by state, the age of the oldest ready job and jobs finished per minute over
+        the last window seconds"""
+        now = time.time()
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            ready, oldest = db.execute("SELECT COUNT(*), MIN(created_at) FROM jobs "
+                                       "WHERE status = 'queued' AND available_at <= ?", (now,)).fetchone()
+            done = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'done' AND finished_at >= ?",
+                              (now - window,)).fetchone()[0]
+            failed = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'failed' AND finished_at >= ?",
+                                (now - window,)).fetchone()[0]
+        return {
+            "queued": counts.get("queued", 0),
+            "ready": ready,
+            # Waiting for the backoff of a retry
+            "delayed": counts.get("queued", 0) - ready,
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_ready_seconds": None if oldest is None else now - oldest,
+            "jobs_per_minute": done / (window / 60),
+            "failed_per_minute": failed / (window / 60),
+        }
+
+    def jobs(self, status=None, limit=20):
+        """The most recent jobs (with a status, or all of them), as dicts"""
+        query = "SELECT id, priority, status, attempts, max_attempts, error, created_at, finished_at FROM jobs"
+        args = ()
+        if status:
+            query += " WHERE status = ?"
+            args = (status,)
+        with self._connect() as db:
+            return [dict(row) for row in db.execute(query + " ORDER BY id DESC LIMIT ?", args + (limit,))]
@@ -0,0 +1,284 @@
+from pathlib import Path
+import os
+import json
+import time
+import math
+import hashlib
+import tempfile
+import traceback
+import numpy as np
+from cache_tools import evict, file_hash, publish, read_json, remove_entry, touch, write_json, writer_id
+from compositor import active_rows
+from overlay_decoder import probe_overlay, decode_overlay, overlay_frame_count, sequence_frames
+
+# Decoded overlays live next to the results, outside of the source tree (OVERLAY_CACHE_DIR overrides it)
+CACHE_DIR = Path(os.getenv("OVERLAY_CACHE_DIR", Path(__file__).parent.parent / "cache/overlays"))
+# Upper bound for the cache on disk (a 1080x1920 RGB frame is ~6 MB)
+DEFAULT_MAX_BYTES = int(float(os.getenv("OVERLAY_CACHE_MAX_GB", "10")) * 1024 ** 3)
+# Flattened stacks are built for video lengths rounded up to this many seconds
+STACK_BUCKET_SECONDS = 10
+# Stacks larger than this part of the cache are flattened frame by frame instead of being stored
+STACK_MAX_FRACTION = 0.5
+# Part of every cache key; bumped when the layout of the cached frames changes
+CACHE_VERSION = 2
+
+class OverlayFrames:
+    """Decoded, scaled and cropped overlay frames backed by a memory-mapped array"""
+
+    def __init__(self, source, frames, fps, premultiplied=False, rows=None):
+        self.source = source
+        self.frames = frames
+        self.fps = fps
+        # Premultiplied tracks are RGBA with the color already scaled by alpha
+        self.premultiplied = premultiplied
+        # Per frame, the row runs that have any visible pixel (see compositor.active_rows)
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame(self, index):
+        """Frame for a video frame index, looping the overlay if the video is longer"""
+        return self.frames[index % len(self.frames)]
+
+    def active_rows(self, index):
+        """Row runs of a frame that need blending, or None for the whole frame"""
+        return None if self.rows is None else self.rows[index % len(self.rows)]
+
+class FlattenedStack:
+    """Overlay tracks flattened one frame at a time as it is read, for stacks too large to cache"""
+
+    def __init__(self, tracks, width, height, fps, grade=None):
+        self.tracks = tracks
+        self.source = [track.source for track, _ in tracks]
+        self.fps = fps
+        self.premultiplied = True
+        self.grade = grade
+        self.color = np.empty((height, width, 3), dtype=np.float32)
+        self.alpha = np.empty((height, width, 1), dtype=np.float32)
+        self.buffer = np.empty((height, width, 4), dtype=np.uint8)
+        self.index = None
+        self.rows = None
+
+    def frame(self, index):
+        """Flattened frame for a video frame index; valid until the next call"""
+        if index != self.index:
+            _flatten(self.tracks, index, self.color, self.alpha, self.buffer, self.grade)
+            self.index = index
+            self.rows = active_rows(self.buffer[..., 3])
+        return self.buffer
+
+    def active_rows(self, index):
+        self.frame(index)
+        return self.rows
+
+def source_hash(path, cache_dir=CACHE_DIR):
+    """file_hash of an overlay file, or of every frame of a PNG sequence directory"""
+    path = Path(path)
+    if not path.is_dir():
+        return file_hash(path, cache_dir)
+    digest = hashlib.sha256()
+    for frame_path in sequence_frames(path):
+        digest.update(f"{frame_path.name}:{file_hash(frame_path, cache_dir)}\n".encode())
+    return digest.hexdigest()
+
+def cache_key(source_hash, width, height, fps):
+    return f"{source_hash[:32]}_{width}x{height}_{fps}fps_v{CACHE_VERSION}"
+
+def load_overlay(effect_path, width, height, fps, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """Return the overlay as OverlayFrames, decoding and caching it on the first use.
+
+    Overlays with an alpha channel are cached as premultiplied RGBA, the others as RGB.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    effect_path = Path(effect_path).resolve()
+    digest = source_hash(effect_path, cache_dir)
+    key = cache_key(digest, width, height, fps)
+    frames_path = cache_dir / f"{key}.npy"
+    meta_path = cache_dir / f"{key}.json"
+
+    if frames_path.exists() and meta_path.exists():
+        print(f"Using cached overlay frames for {effect_path.name}")
+    else:
+        print(f"Decoding overlay {effect_path.name} into the cache...")
+        _drop_stale_entries(effect_path, digest, key, cache_dir)
+        _build_entry(effect_path, frames_path, width, height, fps)
+        write_json(meta_path, {"source": str(effect_path), "width": width, "height": height,
+                               "fps": fps, "created": time.time()})
+        evict(cache_dir, "*.npy", max_bytes, keep={key}, label="overlay")
+
+    touch(meta_path)
+    frames = np.load(frames_path, mmap_mode="r")
+    return OverlayFrames(effect_path, frames, fps, premultiplied=frames.shape[-1] == 4)
+
+def load_overlay_stack(effect_paths, opacities, width, height, fps, n_frames,
+                       cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, grade=None):
+    """Return the whole effect stack flattened into one premultiplied RGBA track.
+
+    Effects are stacked in alphabetical order by filename. Each effect's own alpha channel (if it
+    has one) is scaled by its opacity, and the fully transparent row bands of a frame are skipped.
+    With a ColorGrade every effect frame is graded while flattening, so the cached track is already
+    graded. The flattened track repeats after the common period of the effects, so it is cached
+    for that period, or for the video length rounded up to STACK_BUCKET_SECONDS if that is shorter.
+    There is one entry per effect list, opacities, grade and target size/fps, together with the
+    rows of each frame that have any visible pixel; a longer video replaces an entry that is too
+    short for it. A stack larger than STACK_MAX_FRACTION of max_bytes (e.g. co-prime effect lengths
+    in a long video) is not stored: it is flattened frame by frame from the cached effects instead.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    layers = sorted(zip((Path(p).resolve() for p in effect_paths), opacities), key=lambda l: l[0].name)
+    bucket = STACK_BUCKET_SECONDS * fps
+    bucket_frames = max(1, math.ceil(n_frames / bucket)) * bucket
+
+    hashes = [source_hash(path, cache_dir) for path, _ in layers]
+    signature = [[digest, round(opacity, 4)] for digest, (_, opacity) in zip(hashes, layers)]
+    if grade is not None:
+        signature.append(grade.signature())
+    signature = json.dumps(signature)
+    key = f"stack_{hashlib.sha256(signature.encode()).hexdigest()[:32]}_{width}x{height}_{fps}fps_v{CACHE_VERSION}"
+    frames_path = cache_dir / f"{key}.npy"
+    meta_path = cache_dir / f"{key}.json"
+
+    meta = read_json(meta_path) if frames_path.exists() else None
+    # A whole period serves any video length, a shorter entry only the videos that fit in it
+    if meta is not None and (meta.get("frames") == meta.get("period") or meta.get("frames", 0) >= n_frames):
+        frames = np.load(frames_path, mmap_mode="r")
+        # (another render may have replaced the entry between reading the two files)
+        if len(frames) == meta["frames"]:
+            print(f"Using cached flattened overlay stack ({len(layers)} effects)")
+            touch(meta_path)
+            return OverlayFrames([path for path, _ in layers], frames, fps, premultiplied=True, rows=meta.get("rows"))
+
+    tracks = []
+    for path, opacity in layers:
+        try:
+            print(f"Adding effect from: {path}")
+            tracks.append((load_overlay(path, width, height, fps, cache_dir, max_bytes), opacity))
+            print(f"Effect '{path.name}' added successfully with opacity {opacity:.2f}")
+        except Exception as e:
+            print(f"Error adding effect {path}: {e}. Skipping this effect.")
+            traceback.print_exc()
+    if not tracks:
+        return None
+
+    # Overlays loop with their own lengths, so the stack repeats after their common period
+    period = 1
+    for track, _ in tracks:
+        period = period * len(track) // math.gcd(period, len(track))
+    length = min(period, bucket_frames)
+    complete = len(tracks) == len(layers)
+
+    stack_bytes = length * height * width * 4
+    if stack_bytes > STACK_MAX_FRACTION * max_bytes:
+        print(f"The flattened overlay stack would take {stack_bytes / 1024 ** 3:.1f} GB ({length} frames), "
+              f"more than {STACK_MAX_FRACTION:.0%} of the {max_bytes / 1024 ** 3:.1f} GB overlay cache; "
+              f"flattening the {len(tracks)} effects frame by frame instead")
+        return FlattenedStack(tracks, width, height, fps, grade)
+
+    print(f"Flattening {len(tracks)} effects into one overlay track ({length} frames)...")
+    # A unique name: a stack with missing effects stays mapped under it after this returns
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f"{key}.{writer_id()}.", suffix=".tmp.npy")
+    os.close(fd)
+    frames = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8,
+                                       shape=(length, height, width, 4))
+    color = np.empty((height, width, 3), dtype=np.float32)
+    alpha = np.empty((height, width, 1), dtype=np.float32)
+    rows = []
+    for i in range(length):
+        _flatten(tracks, i, color, alpha, frames[i], grade)
+        rows.append(active_rows(frames[i, ..., 3]))
+    frames.flush()
+    del frames
+
+    if not complete:
+        # Don't cache a stack with missing effects; a later render may load them fine. The frames
+        # stay memory-mapped from the temporary file, which can be deleted while mapped on POSIX;
+        # elsewhere evict() removes it once it is stale.
+        frames = np.load(tmp_path, mmap_mode="r")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return OverlayFrames([track.source for track, _ in tracks], frames, fps, premultiplied=True, rows=rows)
+
+    publish(tmp_path, frames_path)
+    write_json(meta_path, {"source": [str(path) for path, _ in layers], "hashes": hashes,
+                           "opacities": [opacity for _, opacity in layers],
+                           "width": width, "height": height, "fps": fps,
+                           "frames": length, "period": period, "rows": rows, "created": time.time()})
+    evict(cache_dir, "*.npy", max_bytes, keep={key}, label="overlay")
+    return OverlayFrames([path for path, _ in layers], np.load(frames_path, mmap_mode="r"),
+                         fps, premultiplied=True, rows=rows)
+
+def _flatten(tracks, index, color, alpha, out, grade=None):
+    """Blend frame index of every (track, opacity) into out as premultiplied RGBA uint8, using the
+    float32 color and alpha arrays as accumulators"""
+    color.fill(0)
+    alpha.fill(0)
+    for track, opacity in tracks:
+        layer = track.frame(index)
+        if not track.premultiplied:
+            _over(color, alpha, layer, opacity, grade)
+            continue
+        # Only the bands of rows where the effect is visible are blended
+        for y0, y1 in active_rows(layer[..., 3]):
+            _over(color[y0:y1], alpha[y0:y1], layer[y0:y1], opacity, grade)
+    alpha *= 255.0
+    np.minimum(color, alpha, out=color)
+    out[..., :3] = color + 0.5
+    out[..., 3:] = alpha + 0.5
+
+def _over(color, alpha, layer, opacity, grade=None):
+    """Porter-Duff "over" of one effect frame (RGB, or premultiplied RGBA) with an opacity onto
+    float32 premultiplied color (0-255) and alpha (0-1) accumulators, in place"""
+    if layer.shape[-1] == 3:
+        layer_alpha = np.float32(opacity)
+        layer_color = grade.apply(layer) if grade is not None else layer
+    else:
+        layer_alpha = layer[..., 3:] * np.float32(opacity / 255.0)
+        layer_color = layer[..., :3]
+        if grade is not None:
+            # Grade the straight color, then premultiply it again
+            coverage = layer[..., 3:].astype(np.float32)
+            straight = np.clip(layer_color * 255.0 / np.maximum(coverage, 1.0) + 0.5, 0, 255).astype(np.uint8)
+            layer_color = grade.apply(straight) * (coverage / 255.0)
+    color *= 1.0 - layer_alpha
+    color += layer_color * np.float32(opacity)
+    alpha *= 1.0 - layer_alpha
+    alpha += layer_alpha
+
+def _build_entry(effect_path, frames_path, width, height, fps):
+    """Decode the overlay once (with its alpha channel, if any), scale it to cover the canvas and
+    store the cropped frames"""
+    info = probe_overlay(effect_path)
+    n_frames = overlay_frame_count(info, fps)
+    channels = 4 if info["has_alpha"] else 3
+    if info["has_alpha"]:
+        print(f"{effect_path.name} has an alpha channel ({info['pix_fmt'] or info['codec']})")
+    tmp_path = frames_path.with_name(f"{frames_path.stem}.{writer_id()}.tmp.npy")
+    frames = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8,
+                                       shape=(n_frames, height, width, channels))
+    for i, frame in enumerate(decode_overlay(effect_path, width, height, fps, info)):
+        frames[i] = frame
+    frames.flush()
+    del frames
+    publish(tmp_path, frames_path)
+
+def _drop_stale_entries(effect_path, digest, key, cache_dir):
+    """Remove entries built from an older version of the same source file: its own entries and
+    the flattened stacks that include it"""
+    for meta_path in cache_dir.glob("*.json"):
+        if meta_path.name == "hashes.json" or meta_path.stem == key:
+            continue
+        meta = read_json(meta_path)
+        if not meta:
+            continue
+        source = meta.get("source")
+        if isinstance(source, list):
+            # Stacks record the hash of every source (stacks without them are treated as stale)
+            hashes = meta.get("hashes") or [None] * len(source)
+            stale = any(path == str(effect_path) and h != digest for path, h in zip(source, hashes))
+        else:
+            stale = source == str(effect_path) and not meta_path.stem.startswith(digest[:32])
+        if stale:
+            remove_entry(meta_path.with_suffix(".npy"), "overlay")
@@ -0,0 +1,106 @@
+from pathlib import Path
+import re
+import subprocess
+import numpy as np
+from PIL import Image
+from ffmpeg_tools import FFMPEG_BINARY, probe_media
+
+_VIDEO_STREAM_RE = re.compile(r"Stream #\d+:\d+.*?: Video: (\w+)[^,]*, (\w+)")
+# Pixel formats with an alpha plane (yuva444p12le for ProRes 4444, rgba/argb for PNG and QuickTime RLE, ...)
+_ALPHA_PIX_FMT_RE = re.compile(r"^(yuva|gbrap|ya\d)|rgba|argb|bgra|abgr")
+# Extensions of the images of a PNG sequence (a directory of frames)
+SEQUENCE_EXTENSIONS = (".png",)
+
+def probe_overlay(path):
+    """Duration, codec, pixel format and whether the overlay has an alpha channel, from the header"""
+    path = Path(path)
+    if path.is_dir():
+        frames = sequence_frames(path)
+        if not frames:
+            raise RuntimeError(f"No {'/'.join(SEQUENCE_EXTENSIONS)} frames found in {path}")
+        with Image.open(frames[0]) as image:
+            has_alpha = image.mode in ("RGBA", "LA", "RGBa") or "transparency" in image.info
+        return {"duration": None, "codec": "sequence", "pix_fmt": None, "has_alpha": has_alpha,
+                "frames": len(frames)}
+
+    info, duration = probe_media(path)
+    stream_match = _VIDEO_STREAM_RE.search(info)
+    if not stream_match:
+        raise RuntimeError(f"No video stream found in {path}:\n{info}")
+    codec, pix_fmt = stream_match.groups()
+    if duration is None:
+        raise RuntimeError(f"Could not read the duration of {path}:\n{info}")
+
+    # VP8/VP9 keep the alpha in a side channel that only the libvpx decoders read
+    side_alpha = codec in ("vp8", "vp9") and re.search(r"alpha_mode\s*:\s*1", info) is not None
+    return {"duration": duration, "codec": codec,
+            "pix_fmt": pix_fmt, "has_alpha": side_alpha or bool(_ALPHA_PIX_FMT_RE.search(pix_fmt)),
+            "frames": None}
+
+def sequence_frames(directory):
+    """Frames of a PNG sequence, in filename order"""
+    return sorted(p for p in Path(directory).iterdir() if p.suffix.lower() in SEQUENCE_EXTENSIONS)
+
+def overlay_frame_count(info, fps):
+    """Number of frames the overlay lasts at fps (PNG sequences play one image per video frame)"""
+    if info["frames"] is not None:
+        return info["frames"]
+    return max(1, int(np.floor(info["duration"] * fps + 1e-6)))
+
+def decode_overlay(path, width, height, fps, info=None):
+    """Yield the overlay's frames scaled to cover width x height and center-cropped.
+
+    Overlays with an alpha channel (ProRes 4444, VP9/VP8 webm with alpha, PNG sequences, ...) give
+    premultiplied RGBA frames, the others RGB. Premultiplying before scaling keeps the filter from
+    bleeding the color of transparent pixels into the edges.
+    """
+    path = Path(path)
+    info = info or probe_overlay(path)
+    if path.is_dir():
+        yield from _decode_sequence(path, width, height, info["has_alpha"])
+        return
+
+    channels = 4 if info["has_alpha"] else 3
+    n_frames = overlay_frame_count(info, fps)
+    decoder = []
+    if info["has_alpha"] and info["codec"] in ("vp8", "vp9"):
+        decoder = ["-c:v", "libvpx-vp9" if info["codec"] == "vp9" else "libvpx"]
+    filters = ["format=rgba", "premultiply=inplace=1"] if info["has_alpha"] else []
+    # Scale to cover the entire frame, then crop the center
+    filters += [f"scale={width}:{height}:force_original_aspect_ratio=increase:flags=bicubic",
+                f"crop={width}:{height}", f"fps={fps}"]
+    cmd = [FFMPEG_BINARY, "-hide_banner", "-loglevel", "error"] + decoder + ["-i", str(path),
+           "-vf", ",".join(filters), "-frames:v", str(n_frames),
+           "-f", "rawvideo", "-pix_fmt", "rgba" if channels == 4 else "rgb24", "-"]
+
+    frame_bytes = width * height * channels
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        last = None
+        for _ in range(n_frames):
+            data = process.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                if last is None:
+                    raise RuntimeError(f"Could not decode {path}: {process.stderr.read().decode(errors='replace')}")
+                # The stream ended early (rounded duration): hold the last frame
+                yield last
+                continue
+            last = np.frombuffer(data, dtype=np.uint8).reshape(height, width, channels)
+            yield last
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+        process.stderr.close()
+
+def _decode_sequence(directory, width, height, has_alpha):
+    for frame_path in sequence_frames(directory):
+        with Image.open(frame_path) as image:
+            # PIL resamples premultiplied "RGBa" without bleeding the transparent pixels' color
+            image = image.convert("RGBA").convert("RGBa") if has_alpha else image.convert("RGB")
+            scale = max(width / image.width, height / image.height)
+            size = (max(width, round(image.width * scale)), max(height, round(image.height * scale)))
+            image = image.resize(size, Image.BICUBIC)
+            x = (size[0] - width) // 2
+            y = (size[1] - height) // 2
+            yield np.asarray(image.crop((x, y, x + width, y + height)))
@@ -0,0 +1,93 @@
+from pathlib import Path
+import sys
+import json
+import time
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+class RenderProfiler:
+    """Collects wall time per render stage, per-frame generation/encoder time and peak memory"""
+
+    enabled = True
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.frames = 0
+        self.frame_generation_seconds = 0.0
+        self.encoder_seconds = 0.0
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        """Add the time spent in the block to the stage `name` (stages can be entered many times)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+        stage["seconds"] += seconds
+        stage["calls"] += 1
+
+    def add_frame(self, generation_seconds, encoder_seconds):
+        self.frames += 1
+        self.frame_generation_seconds += generation_seconds
+        self.encoder_seconds += encoder_seconds
+
+    def report(self, output_path=None):
+        wall = time.perf_counter() - self.started
+        busy = self.frame_generation_seconds + self.encoder_seconds
+        return {
+            "output": str(output_path) if output_path else None,
+            "wall_seconds": round(wall, 3),
+            "frames": self.frames,
+            "frames_per_second": round(self.frames / busy, 2) if busy > 0 else None,
+            "frame_generation_seconds": round(self.frame_generation_seconds, 3),
+            "encoder_seconds": round(self.encoder_seconds, 3),
+            "stages": {name: {"seconds": round(stage["seconds"], 3), "calls": stage["calls"]}
+                       for name, stage in self.stages.items()},
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    def write(self, output_path):
+        """Write the report as JSON next to the video (video_1.mp4 -> video_1.profile.json)"""
+        output_path = Path(output_path)
+        report_path = output_path.with_name(output_path.stem + ".profile.json")
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(output_path), f, indent=2)
+        print(f"Render profile saved to: {report_path}")
+        return report_path
+
+class NullProfiler:
+    """Stand-in used when profiling is off: every call is a no-op"""
+
+    enabled = False
+    _null_context = contextlib.nullcontext()
+
+    def timed(self, name):
+        return self._null_context
+
+    def add(self, name, seconds):
+        pass
+
+    def add_frame(self, generation_seconds, encoder_seconds):
+        pass
+
+NULL_PROFILER = NullProfiler()
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its finished children (ffmpeg, workers) in MB"""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
@@ -1,15 +1,133 @@
 import os
 import sys
 import time
+import argparse
+import queue
+import threading
 import traceback
 import subprocess
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from runs import RUNS_DIR, Run, allocate_run
 
-def run_step(step_name, script_path):
-    """Run a Python script and return success/failure"""
-    print("\n" + "="*50)
-    print(f"RUNNING STEP: {step_name}")
-    print("="*50)
+# Stages running at the same time print through this lock, one whole line at a time
+# (reentrant, because in-process stages print through StageOutput while log() holds it)
+_print_lock = threading.RLock()
+
+def log(message=""):
+    with _print_lock:
+        print(message, flush=True)
+
+class StageOutput:
+    """Stand-in for sys.stdout while stages run in this process: every line printed by a stage's
+    thread is tagged with that stage's prefix, like the output of the stage subprocesses"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def set_prefix(self, prefix):
+        self._local.prefix = prefix
+        self._local.buffer = ""
+
+    def write(self, text):
+        prefix = getattr(self._local, "prefix", None)
+        if not prefix:
+            return self.stream.write(text)
+        # Only whole lines are written, so the lines of two stages never get mixed
+        *lines, self._local.buffer = (self._local.buffer + text).split("\n")
+        with _print_lock:
+            for line in lines:
+                self.stream.write(f"{prefix}{line}\n")
+        return len(text)
+
+    def flush(self):
+        buffer = getattr(self._local, "buffer", "")
+        if buffer:
+            self._local.buffer = ""
+            self.write(buffer + "\n")
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class Stage:
+    """One step of the pipeline: a script, the stages it needs, and its status once scheduled.
+    
+    function(context) runs the stage in this process: it reads what the earlier stages put in
+    the context dict, adds its own results and returns True on success.
+    """
+
+    def __init__(self, name, script_path, depends_on=(), function=None, workers=1):
+        self.name = name
+        self.script_path = script_path
+        self.depends_on = list(depends_on)
+        self.function = function
+        self.workers = workers
+        # pending -> running -> succeeded | failed, or skipped when a dependency did not succeed
+        self.status = "pending"
+        self.seconds = None
+
+# In-process stages. Each one imports its module when it runs, so a stage only pays for the
+# libraries it uses (openai, requests, numpy/PIL/ffmpeg tools) and run_all.py itself starts fast.
+# They hand the transcript to each other directly instead of re-reading it. Every job has its own
+# run (context["run_id"], allocated by the text stage if not given), so jobs running at the same
+# time never write to the same files.
+
+def generate_text_stage(context):
+    from generate_text import generate_response, save_text
+    run = Run(context["run_id"]) if "run_id" in context else allocate_run()
+    context["run_id"] = run.run_id
+    transcript = generate_response()
+    if transcript is None:
+        return False
+    context["transcript"] = transcript
+    # The files are still written: they are the results, and subprocess stages read them
+    context["transcript_path"] = save_text(transcript, run)
+    return context["transcript_path"] is not None
+
+def generate_image_stage(context):
+    from generate_image import character_name, generate_image, save_image
+    image_base64 = generate_image(character_name(context["transcript"]))
+    if image_base64 is None:
+        return False
+    context["image_path"] = save_image(image_base64, Run(context["run_id"]))
+    return context["image_path"] is not None
+
+def generate_speech_stage(context):
+    from generate_speech import story_text, text_to_speech
+    run = Run(context["run_id"])
+    context["speech_path"] = text_to_speech(story_text(context["transcript"]), run.speech_path)
+    return context["speech_path"] is not None
+
+def create_video_stage(context):
+    from create_video import create_video, get_effect_paths
+    run = Run(context["run_id"])
+    # "encoder" is set when several videos render at the same time, to share the cores between them
+    video_path = create_video(context["image_path"], context["speech_path"], run.video_path, get_effect_paths(),
+                              encoder=context.get("encoder"))
+    context["video_path"] = video_path
+    return video_path is not None
+
+# Image and speech generation both only need the transcript, so they run at the same time.
+# workers is how many jobs a stage works on at once with --count: the API stages mostly wait on
+# the network, the video stage keeps the CPU busy.
+PIPELINE = [
+    Stage("Text Generation", "generate_text.py", function=generate_text_stage, workers=4),
+    Stage("Image Generation", "generate_image.py", depends_on=["Text Generation"],
+          function=generate_image_stage, workers=4),
+    Stage("Speech Generation", "generate_speech.py", depends_on=["Text Generation"],
+          function=generate_speech_stage, workers=4),
+    Stage("Video Creation", "create_video.py", depends_on=["Image Generation", "Speech Generation"],
+          function=create_video_stage, workers=os.cpu_count() or 1),
+]
+
+def run_step(step_name, script_path, prefix=None, args=()):
+    """Run a Python script (with args) and return success/failure. With a prefix every output
+    line is tagged, so the output of stages running at the same time can be told apart"""
+    log("\n" + "="*50)
+    log(f"RUNNING STEP: {step_name}")
+    log("="*50)
     
     try:
         # Get absolute path to the script
@@ -17,7 +135,7 @@ def run_step(step_name, script_path):
         
         # Run the script as a subprocess
         process = subprocess.Popen(
-            [sys.executable, str(script_abs_path)],
+            [sys.executable, str(script_abs_path)] + [str(arg) for arg in args],
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             universal_newlines=True
@@ -25,39 +143,309 @@ def run_step(step_name, script_path):
         
         # Stream the output in real-time
         for line in process.stdout:
-            print(line.rstrip())
+            log(f"{prefix}{line.rstrip()}" if prefix else line.rstrip())
             
         # Wait for process to complete
         process.wait()
         
         # Check if process was successful
         if process.returncode == 0:
-            print(f"\n✅ {step_name} completed successfully!")
+            log(f"\n✅ {step_name} completed successfully!")
             return True
         else:
-            print(f"\n❌ {step_name} failed with exit code {process.returncode}")
+            log(f"\n❌ {step_name} failed with exit code {process.returncode}")
             return False
             
     except Exception as e:
-        print(f"\n❌ Error running {step_name}: {e}")
+        log(f"\n❌ Error running {step_name}: {e}")
         traceback.print_exc()
         return False
 
+def run_function_step(step_name, function, context, prefix=None):
+    """Run an in-process stage function and return success/failure, like run_step"""
+    log("\n" + "="*50)
+    log(f"RUNNING STEP: {step_name}")
+    log("="*50)
+    
+    output = sys.stdout if isinstance(sys.stdout, StageOutput) else None
+    if output is not None:
+        output.set_prefix(prefix)
+    try:
+        if function(context):
+            log(f"\n✅ {step_name} completed successfully!")
+            return True
+        log(f"\n❌ {step_name} failed")
+        return False
+    except Exception as e:
+        log(f"\n❌ Error running {step_name}: {e}")
+        traceback.print_exc()
+        return False
+    finally:
+        if output is not None:
+            output.flush()
+            output.set_prefix(None)
+
+def _check_stages(stages, in_process):
+    """Raise ValueError for unknown or circular dependencies; return the stages by name"""
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dependency in stage.depends_on:
+            if dependency not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dependency}'")
+        if in_process and stage.function is None:
+            raise ValueError(f"Stage '{stage.name}' has no function to run in process")
+    
+    # Remove stages whose dependencies are all removed; whatever remains is in a cycle
+    remaining = {stage.name: set(stage.depends_on) for stage in stages}
+    while True:
+        free = [name for name, dependencies in remaining.items() if not dependencies & remaining.keys()]
+        if not free:
+            break
+        for name in free:
+            del remaining[name]
+    if remaining:
+        raise ValueError(f"Stages with circular dependencies: {', '.join(remaining)}")
+    return by_name
+
+def run_pipeline(stages, in_process=True, context=None, label=None, script_args=(), on_success=None):
+    """Run the stages as a dependency graph and return True if all of them succeeded.
+    
+    A stage starts as soon as every stage it depends on has succeeded, so independent stages
+    run at the same time. When a stage fails, everything that depends on it (directly or not)
+    is skipped, while the stages that don't keep running.
+    
+    In process, the stages' functions share the context dict (a new one if None). Otherwise every
+    stage runs its script in a separate Python process, which isolates crashes and memory.
+    label (e.g. a job number) is added to the stage names in the output, and script_args to the
+    command line of every script. on_success(stage) is called after every stage that succeeds.
+    """
+    by_name = _check_stages(stages, in_process)
+    context = {} if context is None else context
+    
+    def name(stage):
+        return f"{stage.name} {label}" if label else stage.name
+    
+    running = {}
+    started = {}
+    stdout = sys.stdout
+    # Pipelines running at the same time (worker_daemon.py) share the StageOutput of the first one
+    if in_process and not isinstance(stdout, StageOutput):
+        sys.stdout = StageOutput(stdout)
+    try:
+        with ThreadPoolExecutor(max_workers=len(stages)) as pool:
+            while True:
+                # Skipping a stage can make the stages after it skippable, so repeat until nothing changes
+                changed = True
+                while changed:
+                    changed = False
+                    for stage in stages:
+                        if stage.status != "pending":
+                            continue
+                        dependencies = [by_name[name] for name in stage.depends_on]
+                        blocked = [d.name for d in dependencies if d.status in ("failed", "skipped")]
+                        if blocked:
+                            stage.status = "skipped"
+                            log(f"\n⏭️  Skipping {name(stage)}: {', '.join(blocked)} did not succeed")
+                            changed = True
+                        elif all(d.status == "succeeded" for d in dependencies):
+                            stage.status = "running"
+                            started[stage.name] = time.perf_counter()
+                            if in_process:
+                                future = pool.submit(run_function_step, name(stage), stage.function, context,
+                                                     f"[{name(stage)}] ")
+                            else:
+                                future = pool.submit(run_step, name(stage), stage.script_path, f"[{name(stage)}] ",
+                                                     script_args)
+                            running[future] = stage
+                            changed = True
+                
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    stage.seconds = time.perf_counter() - started[stage.name]
+                    stage.status = "succeeded" if future.result() else "failed"
+                    if stage.status == "succeeded" and on_success is not None:
+                        on_success(stage)
+    finally:
+        sys.stdout = stdout
+    return all(stage.status == "succeeded" for stage in stages)
+
+class Job:
+    """One video of a --count run: its own context and the status and duration of each stage"""
+
+    def __init__(self, number, stages, context=None):
+        self.number = number
+        self.context = dict(context or {})
+        self.status = {stage.name: "pending" for stage in stages}
+        self.seconds = {}
+        # From when its first stage starts until its last stage ends
+        self.started = None
+        self.finished = None
+
+    @property
+    def succeeded(self):
+        return all(status == "succeeded" for status in self.status.values())
+
+def run_jobs(stages, count, workers=None, queue_size=1, context=None):
+    """Make count videos with the stages working as a pipeline, and return the jobs.
+    
+    Every stage has its own workers (stage.workers, or workers[stage.name]) taking jobs from a
+    bounded queue, so while one job renders, the next ones are already generating their image,
+    speech and text. A stage whose queue is full blocks the stages before it, which keeps the
+    text and API stages from running more than queue_size jobs ahead of the renders.
+    
+    Each job starts with a copy of context. Failed stages skip the rest of their job only.
+    """
+    workers = {stage.name: (workers or {}).get(stage.name, stage.workers) for stage in stages}
+    _check_stages(stages, in_process=True)
+    dependents = {stage.name: [s for s in stages if stage.name in s.depends_on] for stage in stages}
+    queues = {stage.name: queue.Queue(maxsize=queue_size) for stage in stages}
+    jobs = []
+    state_lock = threading.Lock()
+    all_done = threading.Condition(state_lock)
+    
+    def skip(job, stage, reason):
+        job.status[stage.name] = "skipped"
+        log(f"\n⏭️  Skipping {stage.name} #{job.number}: {reason} did not succeed")
+        for dependent in dependents[stage.name]:
+            if job.status[dependent.name] == "pending":
+                skip(job, dependent, stage.name)
+    
+    def finish(job, stage, status):
+        ready = []
+        with state_lock:
+            job.status[stage.name] = status
+            for dependent in dependents[stage.name]:
+                if job.status[dependent.name] != "pending":
+                    continue
+                if status != "succeeded":
+                    skip(job, dependent, stage.name)
+                elif all(job.status[name] == "succeeded" for name in dependent.depends_on):
+                    job.status[dependent.name] = "queued"
+                    ready.append(dependent)
+            if all(s in ("succeeded", "failed", "skipped") for s in job.status.values()):
+                job.finished = time.perf_counter()
+                all_done.notify_all()
+        # Outside the lock: this blocks while the next stage is full (back-pressure)
+        for dependent in ready:
+            queues[dependent.name].put(job)
+    
+    def work(stage):
+        while True:
+            job = queues[stage.name].get()
+            if job is None:
+                return
+            start = time.perf_counter()
+            with state_lock:
+                job.status[stage.name] = "running"
+                if job.started is None:
+                    job.started = start
+            label = f"{stage.name} #{job.number}"
+            success = run_function_step(label, stage.function, job.context, f"[{label}] ")
+            job.seconds[stage.name] = time.perf_counter() - start
+            finish(job, stage, "succeeded" if success else "failed")
+    
+    stdout = sys.stdout
+    sys.stdout = StageOutput(stdout)
+    threads = []
+    try:
+        for stage in stages:
+            for _ in range(workers[stage.name]):
+                thread = threading.Thread(target=work, args=(stage,), daemon=True)
+                thread.start()
+                threads.append((stage, thread))
+        
+        # Jobs enter the first stages as fast as those stages take them
+        first_stages = [stage for stage in stages if not stage.depends_on]
+        for number in range(1, count + 1):
+            job = Job(number, stages, context)
+            with state_lock:
+                jobs.append(job)
+                for stage in first_stages:
+                    job.status[stage.name] = "queued"
+            for stage in first_stages:
+                queues[stage.name].put(job)
+        
+        with state_lock:
+            all_done.wait_for(lambda: all(job.finished is not None for job in jobs))
+        for stage, _ in threads:
+            queues[stage.name].put(None)
+        for _, thread in threads:
+            thread.join()
+    finally:
+        sys.stdout = stdout
+    return jobs
+
+def print_throughput(stages, jobs, wall_seconds, workers=None):
+    """Videos made, videos per hour and, per stage, the average duration and how busy its workers were"""
+    workers = {stage.name: (workers or {}).get(stage.name, stage.workers) for stage in stages}
+    succeeded = [job for job in jobs if job.succeeded]
+    log("\n" + "="*50)
+    log("THROUGHPUT SUMMARY")
+    log("="*50)
+    log(f"Videos: {len(succeeded)}/{len(jobs)} succeeded in {wall_seconds:.1f}s")
+    if succeeded and wall_seconds > 0:
+        latencies = sorted(job.finished - job.started for job in succeeded)
+        log(f"Throughput: {len(succeeded) / wall_seconds * 3600:.1f} videos/hour "
+            f"({wall_seconds / len(succeeded):.1f}s per video)")
+        log(f"Time per video from start to finish: median {latencies[len(latencies) // 2]:.1f}s, "
+            f"max {latencies[-1]:.1f}s")
+    # The busiest stage is the bottleneck: give it more workers (or the others fewer)
+    log(f"{'Stage':<20} {'workers':>7} {'runs':>5} {'failed':>6} {'avg':>8} {'busy':>6}")
+    for stage in stages:
+        durations = [job.seconds[stage.name] for job in jobs if stage.name in job.seconds]
+        failed = sum(1 for job in jobs if job.status[stage.name] == "failed")
+        average = f"{sum(durations) / len(durations):.1f}s" if durations else "-"
+        busy = sum(durations) / (wall_seconds * workers[stage.name]) if wall_seconds > 0 else 0
+        log(f"{stage.name:<20} {workers[stage.name]:>7} {len(durations):>5} {failed:>6} {average:>8} {busy:>6.0%}")
+
+def print_summary(stages, wall_seconds):
+    """Status and duration of every stage"""
+    icons = {"succeeded": "✅", "failed": "❌", "skipped": "⏭️ ", "pending": "⏸️ "}
+    log("\n" + "="*50)
+    log("PIPELINE SUMMARY")
+    log("="*50)
+    for stage in stages:
+        duration = f"{stage.seconds:.1f}s" if stage.seconds is not None else "-"
+        log(f"{icons.get(stage.status, '?')} {stage.name:<20} {stage.status:<10} {duration:>8}")
+    log(f"Total time: {wall_seconds:.1f}s")
+
 def ensure_directories_exist():
     """Create all necessary directories for the pipeline"""
     base_dir = Path(__file__).parent.parent
     dirs = [
         base_dir / "results",
-        base_dir / "results/transcripts",
-        base_dir / "results/images",
-        base_dir / "results/speeches",
-        base_dir / "results/videos",
+        RUNS_DIR,
     ]
     
     for directory in dirs:
         directory.mkdir(exist_ok=True, parents=True)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a video from scratch: text, image, speech and video")
+    parser.add_argument("--subprocess", action="store_true",
+                        help="Run every stage as its own Python script instead of in this process")
+    parser.add_argument("--count", type=int, default=1,
+                        help="Make N videos, with the stages of different videos running at the same time")
+    parser.add_argument("--workers", action="append", default=[], metavar="STAGE=N",
+                        help="With --count, jobs a stage works on at once, e.g. video=4 (stages: text, image, "
+                             "speech, video; default: 4 for the API stages, the CPU count for video)")
+    parser.add_argument("--queue-size", type=int, default=1,
+                        help="With --count, jobs that can wait between two stages (default: 1)")
+    args = parser.parse_args()
+    
+    workers = {}
+    for spec in args.workers:
+        key, _, value = spec.partition("=")
+        matches = [stage.name for stage in PIPELINE if stage.name.lower().startswith(key.strip().lower())]
+        if len(matches) != 1 or not value.isdigit() or int(value) < 1:
+            parser.error(f"--workers {spec}: expected STAGE=N with STAGE one of text, image, speech, video")
+        workers[matches[0]] = int(value)
+    if args.count > 1 and args.subprocess:
+        parser.error("--count runs the stages in this process and can't be used with --subprocess")
+    
     print("\n" + "="*50)
     print("ITALIAN BRAIN ROT VIDEO GENERATOR")
     print("="*50)
@@ -65,25 +453,46 @@ if __name__ == "__main__":
     # Ensure all directories exist
     ensure_directories_exist()
     
-    # Define the steps to run in order
-    steps = [
-        ("Text Generation", "generate_text.py"),
-        ("Image Generation", "generate_image.py"),
-        ("Speech Generation", "generate_speech.py"),
-        ("Video Creation", "create_video.py")
-    ]
+    if args.count > 1:
+        # The renders running at the same time share the cores between their encoders
+        video_workers = workers.get("Video Creation",
+                                    next(stage.workers for stage in PIPELINE if stage.name == "Video Creation"))
+        encoder = dict(threads=max(1, (os.cpu_count() or 1) // video_workers))
+        start = time.perf_counter()
+        jobs = run_jobs(PIPELINE, args.count, workers, queue_size=args.queue_size,
+                        context={"encoder": encoder})
+        print_throughput(PIPELINE, jobs, time.perf_counter() - start, workers)
+        
+        failed = [job.number for job in jobs if not job.succeeded]
+        print("\n" + "="*50)
+        if failed:
+            print(f"{len(failed)} of {len(jobs)} videos failed: #{', #'.join(str(n) for n in failed)}")
+        else:
+            print(f"🎉 ALL {len(jobs)} VIDEOS CREATED SUCCESSFULLY! 🎉")
+        print(f"Check the '{RUNS_DIR}' directory for the videos (one directory per run).")
+        print("="*50)
+        sys.exit(1 if failed else 0)
+    
+    # Every stage works in this run's directory, also when it runs as a script
+    run = allocate_run()
+    print(f"Run: {run.run_id}")
+    
+    # Run the stages as soon as their inputs are ready (image and speech at the same time)
+    start = time.perf_counter()
+    success = run_pipeline(PIPELINE, in_process=not args.subprocess, context={"run_id": run.run_id},
+                           script_args=["--run-id", run.run_id])
+    print_summary(PIPELINE, time.perf_counter() - start)
     
-    # Run each step, stopping if one fails
-    for step_name, script_path in steps:
-        if not run_step(step_name, script_path):
-            print("\n" + "="*50)
-            print(f"Pipeline stopped due to failure in: {step_name}")
-            print("="*50)
-            sys.exit(1)
+    if not success:
+        failed = [stage.name for stage in PIPELINE if stage.status == "failed"]
+        print("\n" + "="*50)
+        print(f"Pipeline stopped due to failure in: {', '.join(failed)}")
+        print("="*50)
+        sys.exit(1)
     
     print("\n" + "="*50)
     print("🎉 ALL STEPS COMPLETED SUCCESSFULLY! 🎉")
     print("="*50)
     print("\nYour Italian Brain Rot video has been created.")
-    print("Check the 'results/videos' directory for the final video.")
+    print(f"Video: {run.video_path}")
     print("="*50) 
\ No newline at end of file
@@ -0,0 +1,84 @@
+from pathlib import Path
+import os
+import re
+import tempfile
+
+# Every run of the pipeline gets its own directory here (RUNS_DIR overrides it)
+RUNS_DIR = Path(os.getenv("RUNS_DIR", Path(__file__).parent.parent / "results/runs"))
+# Where the next allocation starts looking, and the most recently started run
+NEXT_ID_FILE = "next_id"
+LATEST_FILE = "latest"
+# Run IDs are zero-padded numbers, so listings sort in the order the runs were started
+RUN_ID_RE = re.compile(r"^\d{6,}$")
+
+class Run:
+    """Workspace of one pipeline run: a directory holding its transcript, image, speech and video"""
+
+    def __init__(self, run_id, runs_dir=RUNS_DIR):
+        self.run_id = str(run_id)
+        self.path = Path(runs_dir) / self.run_id
+        self.transcript_path = self.path / "transcript.txt"
+        self.image_path = self.path / "image.png"
+        self.speech_path = self.path / "speech.mp3"
+        self.video_path = self.path / "video.mp4"
+        # Previews never replace the video, which is what gets uploaded
+        self.preview_path = self.path / "preview.mp4"
+
+    def exists(self):
+        return self.path.is_dir()
+
+def allocate_run(runs_dir=RUNS_DIR):
+    """Create the directory of a new run and return the Run.
+
+    Creating the directory is what claims the ID: mkdir fails if another process got there
+    first, so runs started at the same time never share an ID. The next_id file only remembers
+    where to start, so the runs directory is never listed.
+    """
+    runs_dir = Path(runs_dir)
+    runs_dir.mkdir(parents=True, exist_ok=True)
+    number = _read_number(runs_dir / NEXT_ID_FILE)
+    while True:
+        run = Run(f"{number:06d}", runs_dir)
+        try:
+            run.path.mkdir()
+            break
+        except FileExistsError:
+            number += 1
+    # Two runs allocated at the same time may write these in either order; a next_id that is
+    # too low only costs a few extra mkdir calls
+    _write_text(runs_dir / NEXT_ID_FILE, str(number + 1))
+    _write_text(runs_dir / LATEST_FILE, run.run_id)
+    return run
+
+def get_run(run_id=None, runs_dir=RUNS_DIR):
+    """The run with the given ID, or the most recently started run; FileNotFoundError if it doesn't exist"""
+    if run_id is None:
+        latest_path = Path(runs_dir) / LATEST_FILE
+        if not latest_path.exists():
+            raise FileNotFoundError(f"No runs found in {runs_dir}. Generate the text first.")
+        run_id = latest_path.read_text(encoding="utf-8").strip()
+    run = Run(run_id, runs_dir)
+    if not run.exists():
+        raise FileNotFoundError(f"Run {run_id} not found in {runs_dir}")
+    return run
+
+def list_runs(runs_dir=RUNS_DIR):
+    """All runs, oldest first"""
+    runs_dir = Path(runs_dir)
+    if not runs_dir.exists():
+        return []
+    return [Run(path.name, runs_dir) for path in sorted(runs_dir.iterdir())
+            if path.is_dir() and RUN_ID_RE.match(path.name)]
+
+def _read_number(path):
+    try:
+        return max(1, int(path.read_text(encoding="utf-8").strip()))
+    except (OSError, ValueError):
+        return 1
+
+def _write_text(path, text):
+    # Written to a temporary file and renamed, so readers never see a partial file
+    with tempfile.NamedTemporaryFile("w", dir=path.parent, prefix=f".{path.name}.", delete=False,
+                                     encoding="utf-8") as f:
+        f.write(text)
+    os.replace(f.name, path)
@@ -0,0 +1,78 @@
+from pathlib import Path
+import os
+import json
+import shutil
+import hashlib
+from ffmpeg_tools import concat_segments
+from cache_tools import evict, publish, touch, writer_id
+
+# Encoded intro and hold segments live next to the other caches (SEGMENT_CACHE_DIR overrides it)
+SEGMENT_CACHE_DIR = Path(os.getenv("SEGMENT_CACHE_DIR", Path(__file__).parent.parent / "cache/segments"))
+DEFAULT_MAX_BYTES = int(float(os.getenv("SEGMENT_CACHE_MAX_GB", "5")) * 1024 ** 3)
+# Part of every key; bumped when the way segments are rendered changes
+CACHE_VERSION = 1
+
+class SegmentCache:
+    """Encoded video segments (no audio) of past renders, keyed by everything their frames depend on.
+
+    A render that only changes the narration finds its intro (and, for the same length, its hold)
+    here, and only has to encode what is missing before the stream-copy concat and mux.
+    """
+
+    def __init__(self, cache_dir=SEGMENT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, signature, part, start, end, profile):
+        """Key of frames [start, end) of a render with the given source signature, encoded for an
+        OutputProfile (its size and encoder settings; the encoder thread count does not matter)"""
+        encoder = {name: value for name, value in vars(profile.encoder).items() if name != "threads"}
+        data = json.dumps([CACHE_VERSION, signature, part, start, end, profile.width, profile.height, encoder],
+                          sort_keys=True, default=str)
+        return f"{part}_{hashlib.sha256(data.encode()).hexdigest()[:32]}"
+
+    def get(self, key, work_dir):
+        """Hard link (or copy) of the cached segment in work_dir, or None. The render reads the
+        link, so another render evicting the entry meanwhile can't take the file away."""
+        path = self.cache_dir / f"{key}.mp4"
+        if not touch(path):
+            return None
+        link_path = Path(work_dir) / f"cached_{key}.mp4"
+        try:
+            os.link(path, link_path)
+        except FileNotFoundError:
+            # Evicted since the touch
+            return None
+        except OSError:
+            # Another file system, or no hard links
+            try:
+                shutil.copyfile(path, link_path)
+            except FileNotFoundError:
+                return None
+        return link_path
+    
+    def put(self, key, segment_paths):
+        """Store the segment made of segment_paths (joined with a stream copy if there are several)"""
+        path = self.cache_dir / f"{key}.mp4"
+        tmp_path = path.with_name(f"{key}.{writer_id()}.tmp.mp4")
+        if len(segment_paths) == 1:
+            shutil.copyfile(segment_paths[0], tmp_path)
+        else:
+            concat_segments(segment_paths, tmp_path, work_dir=Path(segment_paths[0]).parent)
+        publish(tmp_path, path)
+        self.evict(keep={key})
+    
+    def evict(self, keep=()):
+        """Delete least recently used segments until the cache fits in max_bytes"""
+        evict(self.cache_dir, "*.mp4", self.max_bytes, keep=keep, label="segment")
+
+def get_segment_cache(cache):
+    """Accept a SegmentCache, True (the default cache), a directory or None/False (no caching)"""
+    if cache is None or cache is False:
+        return None
+    if cache is True:
+        return SegmentCache()
+    if isinstance(cache, SegmentCache):
+        return cache
+    return SegmentCache(cache)
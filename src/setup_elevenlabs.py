@@ -68,8 +68,10 @@ def test_elevenlabs():
     print(f"Sample text: {sample_text}")
     print("\nGenerating speech...")
     
-    # Generate speech
-    speech_file = text_to_speech(sample_text)
+    # Generate speech (outside of the runs, so it is never mistaken for a run's narration)
+    test_path = Path(__file__).parent.parent / "results/elevenlabs_test.mp3"
+    test_path.parent.mkdir(parents=True, exist_ok=True)
+    speech_file = text_to_speech(sample_text, test_path)
     
     if speech_file:
         print(f"✅ Test successful! Speech file created: {speech_file}")
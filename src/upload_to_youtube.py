@@ -1,49 +1,29 @@
-import os
+import argparse
 import google.oauth2.credentials
 import google_auth_oauthlib.flow
 import googleapiclient.discovery
 import googleapiclient.errors
 import googleapiclient.http
 from pathlib import Path
+from runs import get_run
 
 
-def get_latest_file_number(directory, prefix, extension):
-    """Find the highest numbered file with the given prefix and extension."""
-    files = [f for f in os.listdir(directory) if f.startswith(prefix) and f.endswith(extension)]
-    if not files:
-        return 0
-    numbers = [int(f.split('_')[1].split('.')[0]) for f in files]
-    return max(numbers)
-
-
-def get_latest_video_path():
-    """Get the path to the latest generated video file."""
-    # Path to the videos directory (relative to this script)
-    videos_dir = Path(__file__).parent / "../results/videos"
-    
-    # Get the latest video number
-    video_num = get_latest_file_number(videos_dir, "video", "mp4")
-    
-    # Get the path to the latest video
-    video_path = videos_dir / f"video_{video_num}.mp4"
+def get_video_path(run):
+    """Get the path to the video of a run."""
+    if not run.video_path.exists():
+        raise FileNotFoundError(f"Video file of run {run.run_id} not found: {run.video_path}")
     
-    if not video_path.exists():
-        raise FileNotFoundError(f"Latest video file not found: {video_path}")
-    
-    return video_path
+    return run.video_path
 
 
-def get_first_line_transcript():
-    """Get the content of the latest transcript file for video description."""
-    transcripts_dir = Path(__file__).parent / "../results/transcripts"
-    
-    transcript_path = transcripts_dir / "first_line_transcript.txt"
-    
-    if not transcript_path.exists():
+def get_first_line_transcript(run):
+    """Get the first line of the run's transcript for the video title and description."""
+    if not run.transcript_path.exists():
         return "AI-generated cat story video"
     
-    with open(transcript_path, "r") as f:
-        content = f.read().strip()
+    with open(run.transcript_path, "r", encoding="utf-8") as f:
+        lines = f.read().strip().split("\n")
+    content = lines[0].strip()
     
     # Transform "A x Story." into "A x cat Story"
     if "sad" in content.lower():
@@ -97,14 +77,14 @@ def get_authenticated_service():
         API_SERVICE_NAME, API_VERSION, credentials=credentials)
 
 
-def upload_video(video_path):
+def upload_video(video_path, run):
     """Upload the video to YouTube."""
     try:
         # Get authenticated service
         youtube = get_authenticated_service()
         
-        # Get latest transcript for video description
-        description = get_first_line_transcript()
+        # Get the run's transcript for the video description
+        description = get_first_line_transcript(run)
         print(f"\nVideo type: {description}")
         
         # Define video metadata
@@ -160,21 +140,26 @@ def upload_video(video_path):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Upload the video of a run to YouTube")
+    parser.add_argument("--run-id", default=None, help="Run to upload (default: the latest run)")
+    args = parser.parse_args()
+    
     print("\n" + "="*50)
     print("          YOUTUBE VIDEO UPLOADER")
     print("="*50)
     
     try:
-        # Get the latest video path
-        print("\nLooking for the latest generated video...")
-        video_path = get_latest_video_path()
+        # Get the run's video path
+        run = get_run(args.run_id)
+        print(f"\nLooking for the video of run {run.run_id}...")
+        video_path = get_video_path(run)
         print(f"Found video: {video_path}")
         
         # Upload the video
         print("\n" + "="*50)
         print("          UPLOADING TO YOUTUBE")
         print("="*50)
-        upload_url = upload_video(video_path)
+        upload_url = upload_video(video_path, run)
         
         print("\n" + "="*50)
         if upload_url:
@@ -0,0 +1,212 @@
+import os
+import sys
+import copy
+import time
+import signal
+import socket
+import sqlite3
+import argparse
+import threading
+import traceback
+from job_queue import JOB_QUEUE_DB, JobQueue
+from run_all import PIPELINE, StageOutput, ensure_directories_exist, log, run_pipeline
+
+def warm_up():
+    """Import the stage modules and create the API clients once, so jobs don't pay for it"""
+    log("Loading the pipeline modules...")
+    start = time.perf_counter()
+    import create_video
+    import generate_image
+    import generate_speech
+    from generate_text import get_openai_client
+    try:
+        get_openai_client()
+    except Exception as e:
+        # e.g. OPENAI_API_KEY is not set yet: the text stage will report it for every job
+        log(f"Could not create the OpenAI client: {e}")
+    log(f"Ready in {time.perf_counter() - start:.1f}s")
+
+def job_stages(job):
+    """Copies of the pipeline's stages for a job. The stages an earlier attempt of the job
+    completed are already marked as succeeded, so a retry starts where the job failed."""
+    completed = set(job.context.get("completed_stages", []))
+    stages = []
+    for stage in PIPELINE:
+        stage = copy.copy(stage)
+        stage.status = "succeeded" if stage.name in completed else "pending"
+        stage.seconds = None
+        stages.append(stage)
+    return stages
+
+def run_job(queue, job, worker):
+    """Run the pipeline for a claimed job, extending its lease until it is finished"""
+    done = threading.Event()
+
+    def heartbeat():
+        while not done.wait(queue.visibility_timeout / 3):
+            if not queue.heartbeat(job, worker):
+                log(f"⚠️  Job #{job.id} is no longer leased to this worker, another worker may pick it up")
+                return
+
+    stages = job_stages(job)
+
+    def save_progress(stage):
+        # Recorded after every stage, so a job whose worker dies is resumed after its last
+        # completed stage instead of paying for the API stages again
+        job.context["completed_stages"] = [stage.name for stage in stages if stage.status == "succeeded"]
+        try:
+            queue.save(job, worker)
+        except sqlite3.OperationalError as e:
+            log(f"Could not save the progress of job #{job.id}: {e}")
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    start = time.perf_counter()
+    try:
+        success = run_pipeline(stages, context=job.context, label=f"#{job.id}", on_success=save_progress)
+    except Exception as e:
+        log(f"\n❌ Error running job #{job.id}: {e}")
+        traceback.print_exc()
+        success = False
+    finally:
+        done.set()
+        heartbeat_thread.join()
+
+    job.context["completed_stages"] = [stage.name for stage in stages if stage.status == "succeeded"]
+    seconds = time.perf_counter() - start
+    if success:
+        queue.complete(job, worker)
+        log(f"\n✅ Job #{job.id} done in {seconds:.1f}s: {job.context.get('video_path')}")
+        return True
+
+    failed = [stage.name for stage in stages if stage.status == "failed"]
+    delay = queue.fail(job, worker, f"Failed: {', '.join(failed) or 'pipeline error'}")
+    if delay is None:
+        log(f"\n❌ Job #{job.id} failed after {job.attempts} attempts ({', '.join(failed)})")
+    else:
+        log(f"\n🔁 Job #{job.id} failed ({', '.join(failed)}), retrying in {delay:.0f}s "
+            f"(attempt {job.attempts}/{job.max_attempts})")
+    return False
+
+def worker_loop(queue, worker, stop, encoder=None, poll_interval=2.0):
+    """Claim and run jobs until stop is set"""
+    while not stop.is_set():
+        try:
+            job = queue.claim(worker)
+        except sqlite3.OperationalError as e:
+            # The database is locked for longer than the connection timeout (e.g. a busy disk)
+            log(f"Could not claim a job: {e}")
+            job = None
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+
+        log("\n" + "="*50)
+        log(f"JOB #{job.id} (priority {job.priority}, attempt {job.attempts}/{job.max_attempts})")
+        log("="*50)
+        if encoder is not None:
+            job.context.setdefault("encoder", encoder)
+        run_job(queue, job, worker)
+
+def format_stats(stats):
+    oldest = stats["oldest_ready_seconds"]
+    waiting = f", oldest waiting {oldest / 60:.1f} min" if oldest is not None else ""
+    return (f"Queue: {stats['ready']} ready, {stats['delayed']} waiting to retry, {stats['running']} running{waiting} | "
+            f"done {stats['done']}, failed {stats['failed']} | "
+            f"{stats['jobs_per_minute']:.2f} jobs/min, {stats['failed_per_minute']:.2f} failed/min (last 15 min)")
+
+def run_daemon(queue, workers=1, poll_interval=2.0, stats_interval=60):
+    """Run jobs from the queue with `workers` pipelines at a time, until SIGTERM or Ctrl+C.
+
+    The running jobs are finished before the daemon exits; a job interrupted by a second
+    Ctrl+C (or a crash) is picked up again once its lease has expired.
+    """
+    ensure_directories_exist()
+    warm_up()
+    # The pipelines of all workers print through one StageOutput, each line tagged with its job
+    stdout = sys.stdout
+    sys.stdout = StageOutput(stdout)
+    stop = threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        # `kill` (and systemd/docker stop) stops the daemon the same way as Ctrl+C
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    # Renders running at the same time share the cores between their encoders
+    encoder = dict(threads=max(1, (os.cpu_count() or 1) // workers)) if workers > 1 else None
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    threads = []
+    for i in range(workers):
+        thread = threading.Thread(target=worker_loop, args=(queue, f"{name}:{i}", stop, encoder, poll_interval),
+                                  daemon=True)
+        thread.start()
+        threads.append(thread)
+    log(f"Worker {name} running {workers} job(s) at a time from {queue.path}")
+    log(format_stats(queue.stats()))
+
+    try:
+        while not stop.wait(stats_interval):
+            log(format_stats(queue.stats()))
+    except KeyboardInterrupt:
+        stop.set()
+    log("\nStopping: finishing the running jobs (press Ctrl+C again to quit now)...")
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        log("Quitting; interrupted jobs will be retried when their lease expires")
+    log(format_stats(queue.stats()))
+    sys.stdout = stdout
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make videos from a persistent job queue")
+    parser.add_argument("--db", default=str(JOB_QUEUE_DB), help=f"Queue database (default: {JOB_QUEUE_DB})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run jobs from the queue until stopped")
+    run_parser.add_argument("--workers", type=int, default=1, help="Jobs to run at the same time (default: 1)")
+    run_parser.add_argument("--poll", type=float, default=2.0,
+                            help="Seconds between checks of an empty queue (default: 2)")
+    run_parser.add_argument("--visibility-timeout", type=float, default=600,
+                            help="Seconds without a heartbeat before a running job is given to another "
+                                 "worker (default: 600)")
+    run_parser.add_argument("--backoff", type=float, default=30,
+                            help="Delay before the first retry of a failed job, doubled for every "
+                                 "further attempt (default: 30)")
+    run_parser.add_argument("--stats-interval", type=float, default=60,
+                            help="Seconds between queue statistics (default: 60)")
+
+    enqueue_parser = commands.add_parser("enqueue", help="Add jobs to the queue")
+    enqueue_parser.add_argument("--count", type=int, default=1, help="Number of videos to make (default: 1)")
+    enqueue_parser.add_argument("--priority", type=int, default=0,
+                                help="Higher priorities run first (default: 0)")
+    enqueue_parser.add_argument("--max-attempts", type=int, default=3,
+                                help="Attempts before a job fails for good (default: 3)")
+
+    stats_parser = commands.add_parser("stats", help="Show the queue depth, throughput and recent jobs")
+    stats_parser.add_argument("--list", choices=["queued", "running", "done", "failed"], default=None,
+                              help="Also list the most recent jobs with this status")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "run":
+            queue = JobQueue(args.db, visibility_timeout=args.visibility_timeout, backoff=args.backoff)
+            run_daemon(queue, workers=args.workers, poll_interval=args.poll, stats_interval=args.stats_interval)
+        elif args.command == "enqueue":
+            queue = JobQueue(args.db)
+            ids = [queue.enqueue(priority=args.priority, max_attempts=args.max_attempts) for _ in range(args.count)]
+            print(f"Queued job(s) #{ids[0]}" + (f" to #{ids[-1]}" if len(ids) > 1 else "") +
+                  f" with priority {args.priority}")
+            print(format_stats(queue.stats()))
+        else:
+            queue = JobQueue(args.db)
+            print(format_stats(queue.stats()))
+            if args.list:
+                for job in queue.jobs(args.list):
+                    finished = time.strftime("%Y-%m-%d %H:%M", time.localtime(job["finished_at"])) \
+                        if job["finished_at"] else "-"
+                    print(f"#{job['id']:<6} priority {job['priority']:<3} {job['status']:<8} "
+                          f"attempts {job['attempts']}/{job['max_attempts']}  finished {finished}  {job['error'] or ''}")
+    except Exception as e:
+        print(f"\nUnexpected error: {e}")
+        traceback.print_exc()
+        sys.exit(1)